@@ -2,4 +2,4 @@ set -o errexit
 pip install -r requirements.txt
 
 python manage.py makemigrations
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
@@ -0,0 +1,12 @@
+# Read by gunicorn from the working directory (see Procfile).
+#
+# ASGI=True runs the ASGI app on uvicorn workers instead of sync WSGI
+# workers; settings.ASGI then also routes the public listing reads to the
+# async views. Worker count still comes from WEB_CONCURRENCY.
+import os
+
+if os.getenv('ASGI', 'False') == 'True':
+    wsgi_app = 'realestate.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'realestate.wsgi:application'
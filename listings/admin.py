@@ -1,6 +1,11 @@
 from django.contrib import admin
-from .models import Listing
+from .models import Listing, PendingFileDeletion
 
 admin.site.register(Listing)
 # class ListingAdmin(admin.ModelAdmin):
 
+
+@admin.register(PendingFileDeletion)
+class PendingFileDeletionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'attempts', 'next_attempt_at', 'created_at')
+    search_fields = ('name',)
@@ -0,0 +1,240 @@
+"""
+Response cache for the public listing endpoints.
+
+Cached payloads are keyed on a version counter instead of a TTL: the
+feed and search share a global version, each detail page has its own
+per-slug version. Saving or deleting a listing bumps the counters once
+the transaction commits, so the next request misses and rebuilds; stale
+entries are never read again and simply age out of the backend.
+
+The same counters drive conditional GETs: the ETag is derived from the
+versions and the request, and Last-Modified is the time of the last
+bump (whole seconds, at least one after the bump before), so a
+revalidation is answered with a 304 before any query or serialization
+runs.
+
+The counters live in the cache too, so the backend must be shared by
+all workers (the default is the file-based cache, see settings.CACHES).
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from realestate.metrics import timed_render
+
+CACHE_ALIAS = 'listings'
+GLOBAL_VERSION_KEY = 'listings:version'
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'not_modified': 0})
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _slug_version_key(slug):
+    return f'listings:version:{hashlib.md5(slug.encode()).hexdigest()}'
+
+
+def _get_version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a counter that was evicted (or lost with a
+        # cache restart) never restarts below a value already used in keys.
+        seed = time.time_ns() // 1000
+        cache.add(key, seed, timeout=None)
+        version = cache.get(key, seed)
+    return version
+
+
+def _get_modified(key):
+    cache = get_cache()
+    modified = cache.get(f'{key}:modified')
+    if modified is None:
+        modified = math.ceil(time.time())
+        cache.add(f'{key}:modified', modified, timeout=None)
+    return modified
+
+
+def _bump(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        _get_version(key)
+    # Last-Modified only has whole seconds: move on by at least one, so a
+    # client revalidating the previous version never gets a 304.
+    previous = cache.get(f'{key}:modified', 0)
+    cache.set(f'{key}:modified', max(math.ceil(time.time()), int(previous) + 1), timeout=None)
+
+
+def _version_keys(slug=None):
+    keys = [GLOBAL_VERSION_KEY]
+    if slug is not None:
+        keys.append(_slug_version_key(slug))
+    return keys
+
+
+def get_versions(slug=None):
+    return [_get_version(key) for key in _version_keys(slug)]
+
+
+def get_last_modified(slug=None):
+    # A detail page only changes when its own listing does.
+    key = _version_keys(slug)[-1]
+    return _get_modified(key)
+
+
+def invalidate_listings(slugs=()):
+    """
+    Expire the feed and search caches, plus the detail cache of ``slugs``.
+    """
+    _bump(GLOBAL_VERSION_KEY)
+    for slug in slugs:
+        _bump(_slug_version_key(slug))
+
+
+def invalidate_on_commit(slugs, using=None):
+    """
+    invalidate_listings(``slugs``) once the current transaction commits.
+    Everything queued by one transaction is expired with one bump, so
+    deleting a realtor's hundred listings doesn't move Last-Modified on
+    by a hundred seconds.
+    """
+    connection = transaction.get_connection(using)
+    # Connections are per thread, so this needs no lock. None marks a
+    # pending global bump.
+    pending = connection.__dict__.setdefault('pending_listing_invalidations', set())
+    pending.update(slugs)
+    pending.add(None)
+
+    def flush():
+        # The first callback to run takes everything queued so far; the
+        # later ones find nothing left to do.
+        if pending:
+            slugs = [slug for slug in pending if slug is not None]
+            pending.clear()
+            invalidate_listings(slugs)
+
+    transaction.on_commit(flush, using=using)
+
+
+def response_cache_key(request, kind, versions, signature=None):
+    query = sorted(request.GET.lists()) if signature is None else signature
+    digest = hashlib.md5(repr(query).encode()).hexdigest()
+    version = '.'.join(str(v) for v in versions)
+    return f'listings:{kind}:{version}:{digest}'
+
+
+def cached_response(request, kind, build, slug=None, private=False, signature=None):
+    """
+    Serve ``kind`` from the cache, or call ``build()`` and cache its
+    response when it succeeded. Answers If-None-Match/If-Modified-Since
+    with a 304 before doing either. Entries are keyed on the query string
+    unless a normalized ``signature`` is given.
+    """
+    cache = get_cache()
+    key, etag, last_modified = _validators(request, kind, slug, signature)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        _record(kind, 'not_modified')
+        return _add_validators(not_modified, etag, last_modified, private)
+
+    data = cache.get(key)
+    if data is not None:
+        _record(kind, 'hits')
+        response = Response(data, status=status.HTTP_200_OK, headers={'X-Cache': 'HIT'})
+        return _add_validators(response, etag, last_modified, private)
+
+    _record(kind, 'misses')
+    response = build()
+    response['X-Cache'] = 'MISS'
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(key, response.data)
+        _add_validators(response, etag, last_modified, private)
+    return response
+
+
+async def acached_response(request, kind, build, slug=None, private=False, signature=None):
+    """
+    cached_response() for the async views: ``build`` is a coroutine
+    function returning a json_response(). Shares entries and validators
+    with the sync views.
+    """
+    cache = get_cache()
+    # The version counters are a few cache reads; one thread hop for all.
+    key, etag, last_modified = await sync_to_async(_validators)(request, kind, slug, signature)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        _record(kind, 'not_modified')
+        return _add_validators(not_modified, etag, last_modified, private)
+
+    data = await cache.aget(key)
+    if data is not None:
+        _record(kind, 'hits')
+        response = json_response(data, headers={'X-Cache': 'HIT'})
+        return _add_validators(response, etag, last_modified, private)
+
+    _record(kind, 'misses')
+    response = await build()
+    response['X-Cache'] = 'MISS'
+    if response.status_code == status.HTTP_200_OK:
+        await cache.aset(key, response.data)
+        _add_validators(response, etag, last_modified, private)
+    return response
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    """
+    An already-rendered JSON response for views outside DRF, byte for
+    byte what DRF's JSONRenderer would send. ``data`` is kept on it for
+    the response cache.
+    """
+    with timed_render():
+        content = JSONRenderer().render(data)
+    response = HttpResponse(content, status=status, headers=headers, content_type='application/json')
+    response.data = data
+    return response
+
+
+def _validators(request, kind, slug, signature):
+    key = response_cache_key(request, kind, get_versions(slug), signature)
+    etag = '"%s"' % hashlib.md5(key.encode()).hexdigest()
+    return key, etag, int(get_last_modified(slug))
+
+
+def _add_validators(response, etag, last_modified, private):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Let clients keep the body but revalidate it on every use.
+    if private:
+        patch_cache_control(response, no_cache=True, private=True)
+    else:
+        patch_cache_control(response, no_cache=True, public=True)
+    return response
+
+
+def _record(kind, outcome):
+    with _stats_lock:
+        _stats[kind][outcome] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        return {kind: dict(counts) for kind, counts in _stats.items()}
@@ -0,0 +1,126 @@
+"""
+Deferred removal of listing files from storage.
+
+queue_file_deletion() only inserts PendingFileDeletion rows, so the
+queue commits or rolls back together with the delete/update that
+orphaned the files. delete_pending() claims due rows, skips names a
+listing has started using again, removes the rest from storage and
+retries failures with exponential backoff.
+
+Like the email outbox, the queue is drained either in-process on a
+one-thread pool kicked after each commit (LISTING_FILE_CLEANUP_ON_COMMIT)
+or by the ``process_file_cleanup`` management command; see
+realestate/queue.py. The ``sweep_media`` command finds files that were
+orphaned without going through the queue.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from realestate.queue import Drainer, claim_batch, retry_delay
+from .images import PHOTO_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+def get_storage():
+    from .models import Listing
+    return Listing._meta.get_field('main_photo').storage
+
+
+def queue_file_deletion(names, using=None):
+    """
+    Record ``names`` for removal once the current transaction commits.
+    """
+    from .models import PendingFileDeletion
+
+    names = sorted({name for name in names if name})
+    if not names:
+        return
+    PendingFileDeletion.objects.using(using).bulk_create(
+        [PendingFileDeletion(name=name) for name in names]
+    )
+    if settings.LISTING_FILE_CLEANUP_ON_COMMIT:
+        transaction.on_commit(kick, using=using)
+
+
+def kick():
+    drainer.kick()
+
+
+def referenced_names(names):
+    """
+    The subset of ``names`` still used by some listing, as a photo or as
+    one of its recorded variants.
+    """
+    from .models import Listing
+
+    condition = Q()
+    for field in PHOTO_FIELDS:
+        condition |= Q(**{f'{field}__in': names})
+    for name in names:
+        # Depending on the backend the stored JSON has non-ASCII characters
+        # escaped or not; the listings found are checked properly below.
+        for needle in {name, json.dumps(name)[1:-1]}:
+            condition |= Q(variants_text__contains=needle)
+    listings = (
+        Listing.objects
+        .annotate(variants_text=Cast('photo_variants', TextField()))
+        .filter(condition)
+        .only(*PHOTO_FIELDS, 'photo_variants')
+    )
+    used = set()
+    for listing in listings:
+        used.update(listing.stored_file_names())
+    return used & set(names)
+
+
+def delete_pending(batch_size=None):
+    """
+    Remove one batch of due files. Returns the number of rows processed.
+    """
+    from .models import PendingFileDeletion
+
+    now = timezone.now()
+    rows = claim_batch(PendingFileDeletion.objects.all(), batch_size or settings.LISTING_FILE_CLEANUP_BATCH_SIZE, now)
+    if not rows:
+        return 0
+
+    storage = get_storage()
+    in_use = referenced_names([row.name for row in rows])
+    done = []
+    for row in rows:
+        if row.name in in_use:
+            done.append(row.pk)
+            continue
+        try:
+            storage.delete(row.name)
+        except Exception as e:
+            _failed(row, e)
+        else:
+            done.append(row.pk)
+    PendingFileDeletion.objects.filter(pk__in=done).delete()
+    return len(rows)
+
+
+def _failed(row, error):
+    row.attempts += 1
+    row.last_error = f'{type(error).__name__}: {error}'
+    if row.attempts >= settings.LISTING_FILE_CLEANUP_MAX_ATTEMPTS:
+        # Leave the file for sweep_media rather than retrying forever.
+        logger.error('Giving up on deleting %s after %s attempts: %s', row.name, row.attempts, error)
+        row.delete()
+        return
+    row.next_attempt_at = timezone.now() + retry_delay(
+        row.attempts, settings.LISTING_FILE_CLEANUP_RETRY_BASE, settings.LISTING_FILE_CLEANUP_RETRY_MAX
+    )
+    logger.warning('Could not delete %s (attempt %s), retrying: %s', row.name, row.attempts, error)
+    row.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+
+
+drainer = Drainer('file-cleanup', delete_pending)
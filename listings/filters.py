@@ -0,0 +1,247 @@
+"""
+Search filters shared by the search and facets endpoints, and the facet
+aggregation itself.
+
+parse_filters() validates the query parameters once into a plain dict,
+so both endpoints accept and reject exactly the same input. Each filter
+becomes a Q object; facets for one dimension are counted with every
+filter except that dimension's own, so a sidebar can still show the
+other categories/price ranges while one is selected. All counts come
+from conditional aggregates in a single query.
+"""
+import math
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q
+
+from .geo import within_bbox, within_radius
+from .models import Listing, PublishedListing
+from .search import search_listings
+from .serializers import ListingSerializer
+
+# Facet bins. The last bedroom/bathroom bin is open-ended ("5+"); half
+# bathrooms are counted with the whole number below them.
+BEDROOM_FACETS = range(0, 6)
+BATHROOM_FACETS = range(0, 5)
+
+MAX_RADIUS_KM = 500
+
+
+def _decimal(value, name):
+    try:
+        number = Decimal(value)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'Invalid {name} parameter.')
+    if not number.is_finite():
+        raise ValueError(f'Invalid {name} parameter.')
+    return number
+
+
+def _float(value, name):
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name} parameter.')
+    if not math.isfinite(number):
+        raise ValueError(f'Invalid {name} parameter.')
+    return number
+
+
+def parse_filters(params):
+    """
+    Validate the search query parameters. Returns a dict holding only the
+    filters that were given, or raises ValueError with the message for
+    the client.
+
+    Besides the attribute filters, ``lat``/``lng``/``radius_km`` restrict
+    to a circle and ``bbox=west,south,east,north`` to a box (degrees).
+    """
+    filters = {}
+
+    search = params.get('search')
+    if search:
+        filters['search'] = search
+
+    for name in ('min_price', 'max_price'):
+        if params.get(name):
+            filters[name] = _decimal(params[name], name)
+
+    bedrooms = params.get('bedrooms')
+    if bedrooms:
+        try:
+            filters['bedrooms'] = int(bedrooms)
+        except ValueError:
+            raise ValueError('Invalid bedrooms parameter.')
+
+    bathrooms = params.get('bathrooms')
+    if bathrooms:
+        filters['bathrooms'] = round(_decimal(bathrooms, 'bathrooms'), 1)
+
+    location = params.get('location')
+    if location:
+        filters['location'] = location
+
+    near = [params.get(name) for name in ('lat', 'lng', 'radius_km')]
+    if any(near):
+        if not all(near):
+            raise ValueError('lat, lng and radius_km must be given together.')
+        lat, lng, radius = (_float(value, name) for value, name in zip(near, ('lat', 'lng', 'radius_km')))
+        if not -90 <= lat <= 90 or not -180 <= lng <= 180 or not 0 < radius <= MAX_RADIUS_KM:
+            raise ValueError('Invalid lat, lng or radius_km parameter.')
+        filters['near'] = (lat, lng, radius)
+
+    bbox = params.get('bbox')
+    if bbox:
+        try:
+            west, south, east, north = (float(value) for value in bbox.split(','))
+        except ValueError:
+            raise ValueError('Invalid bbox parameter.')
+        if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= north <= 90):
+            raise ValueError('Invalid bbox parameter.')
+        filters['bbox'] = (south, west, north, east)
+
+    # Unknown categories are ignored rather than rejected, as before.
+    category = (params.get('category') or '').upper()
+    if category in Listing.CategoryChoices.values:
+        filters['category'] = category
+
+    return filters
+
+
+def filter_conditions(filters):
+    """
+    Q objects for the structured filters, keyed by facet dimension.
+    """
+    conditions = {}
+    price = Q()
+    if 'min_price' in filters:
+        price &= Q(price__gte=filters['min_price'])
+    if 'max_price' in filters:
+        price &= Q(price__lte=filters['max_price'])
+    if price:
+        conditions['price'] = price
+    if 'bedrooms' in filters:
+        conditions['bedrooms'] = Q(bedrooms__gte=filters['bedrooms'])
+    if 'bathrooms' in filters:
+        conditions['bathrooms'] = Q(bathrooms__gte=filters['bathrooms'])
+    if 'category' in filters:
+        conditions['category'] = Q(category=filters['category'])
+    return conditions
+
+
+def base_queryset(filters):
+    """
+    Published listings (PublishedListing rows) matching the text search,
+    location and area, the part of the filtering every facet shares. A
+    radius adds a distance_km annotation.
+    """
+    listings = PublishedListing.objects.all()
+    if 'search' in filters:
+        listings = search_listings(listings, filters['search'])
+    if 'location' in filters:
+        listings = listings.filter(location__icontains=filters['location'])
+    if 'bbox' in filters:
+        listings = within_bbox(listings, *filters['bbox'])
+    if 'near' in filters:
+        listings = within_radius(listings, *filters['near'])
+    return listings
+
+
+def filter_listings(filters):
+    """
+    Published listings matching every filter, annotated with search_rank
+    when there is a text search and distance_km when there is a radius.
+    """
+    listings = base_queryset(filters)
+    for condition in filter_conditions(filters).values():
+        listings = listings.filter(condition)
+    return listings
+
+
+def _except(conditions, dimension):
+    q = Q()
+    for name, condition in conditions.items():
+        if name != dimension:
+            q &= condition
+    return q
+
+
+def price_buckets():
+    """
+    [(low, high), ...] from settings.LISTING_PRICE_BUCKETS; the last
+    bucket has no upper bound.
+    """
+    edges = list(settings.LISTING_PRICE_BUCKETS)
+    return list(zip(edges, edges[1:] + [None]))
+
+
+def listing_facets(filters):
+    """
+    Result count, price range and facet counts for ``filters`` in one
+    aggregate query.
+    """
+    conditions = filter_conditions(filters)
+    matching = _except(conditions, None)
+    aggregates = {
+        'count': Count('pk', filter=matching),
+        'min_price': Min('price', filter=matching),
+        'max_price': Max('price', filter=matching),
+    }
+
+    others = _except(conditions, 'price')
+    buckets = price_buckets()
+    for i, (low, high) in enumerate(buckets):
+        bucket = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+        aggregates[f'price_{i}'] = Count('pk', filter=others & bucket)
+
+    others = _except(conditions, 'category')
+    for value in Listing.CategoryChoices.values:
+        aggregates[f'category_{value}'] = Count('pk', filter=others & Q(category=value))
+
+    others = _except(conditions, 'bedrooms')
+    for value in BEDROOM_FACETS:
+        exact = Q(bedrooms__gte=value) if value == BEDROOM_FACETS[-1] else Q(bedrooms=value)
+        aggregates[f'bedrooms_{value}'] = Count('pk', filter=others & exact)
+
+    others = _except(conditions, 'bathrooms')
+    for value in BATHROOM_FACETS:
+        if value == BATHROOM_FACETS[-1]:
+            exact = Q(bathrooms__gte=value)
+        else:
+            exact = Q(bathrooms__gte=value, bathrooms__lt=value + 1)
+        aggregates[f'bathrooms_{value}'] = Count('pk', filter=others & exact)
+
+    row = base_queryset(filters).aggregate(**aggregates)
+    # Render the price range the way listing prices are rendered.
+    price_field = ListingSerializer().fields['price']
+
+    def label(value, values):
+        return f'{value}+' if value == values[-1] else str(value)
+
+    return {
+        'count': row['count'],
+        'price': {
+            'min': None if row['min_price'] is None else price_field.to_representation(row['min_price']),
+            'max': None if row['max_price'] is None else price_field.to_representation(row['max_price']),
+            'buckets': [
+                {'min': low, 'max': high, 'count': row[f'price_{i}']}
+                for i, (low, high) in enumerate(buckets)
+            ],
+        },
+        'category': {value: row[f'category_{value}'] for value in Listing.CategoryChoices.values},
+        'bedrooms': {label(v, BEDROOM_FACETS): row[f'bedrooms_{v}'] for v in BEDROOM_FACETS},
+        'bathrooms': {label(v, BATHROOM_FACETS): row[f'bathrooms_{v}'] for v in BATHROOM_FACETS},
+    }
+
+
+def filter_signature(filters):
+    """
+    A stable representation of ``filters`` for cache keys, so equivalent
+    query strings (parameter order, case of category, "2" vs "2.0")
+    share one entry.
+    """
+    return sorted(
+        (name, format(value.normalize(), 'f') if isinstance(value, Decimal) else str(value))
+        for name, value in filters.items()
+    )
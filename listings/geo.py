@@ -0,0 +1,212 @@
+"""
+Geospatial helpers for listings, without PostGIS.
+
+Every geocoded listing stores a geohash of its coordinates. Nearby cells
+share a prefix, so a bounding box is covered by a handful of prefixes
+and each prefix is a range scan (``geohash >= p AND geohash < next(p)``,
+where next(p) is the following prefix of the same length) on the geohash
+index. Both bounds are geohash strings, which sort the same under byte
+and linguistic collations, so this works on SQLite and Postgres. The
+exact latitude/longitude (and, for a radius, haversine distance) checks
+then only run on the rows inside those cells.
+"""
+import csv
+import math
+import re
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~5m cells, more than enough for a street address
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+# Upper bound on cells used to cover one bounding box. More cells means
+# tighter coverage but a longer OR of range conditions.
+MAX_COVER_CELLS = 16
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, bounds = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    (height, width) in degrees of a geohash cell at ``precision``.
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _cells(south, west, north, east, precision):
+    height, width = cell_size(precision)
+    lat = math.floor(south / height) * height
+    while lat <= north:
+        lng = math.floor(west / width) * width
+        while lng <= east:
+            yield encode_geohash(
+                min(lat + height / 2, 90.0), min(lng + width / 2, 180.0), precision
+            )
+            lng += width
+        lat += height
+
+
+def _cell_count(south, west, north, east, precision):
+    height, width = cell_size(precision)
+    rows = math.floor(north / height) - math.floor(south / height) + 1
+    columns = math.floor(east / width) - math.floor(west / width) + 1
+    return rows * columns
+
+
+def cover_bbox(south, west, north, east):
+    """
+    Geohash prefixes whose cells together cover the box, using the finest
+    precision that needs at most MAX_COVER_CELLS cells. A box crossing the
+    antimeridian (west > east) is split in two.
+    """
+    if west > east:
+        return sorted(set(cover_bbox(south, west, north, 180.0) + cover_bbox(south, -180.0, north, east)))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if _cell_count(south, west, north, east, precision) <= MAX_COVER_CELLS:
+            return sorted(set(_cells(south, west, north, east, precision)))
+    return ['']
+
+
+def geohash_condition(prefixes):
+    """
+    One range condition per prefix; the empty prefix matches everything.
+    """
+    if '' in prefixes:
+        return Q(geohash__gt='')
+    condition = Q()
+    for prefix in prefixes:
+        upper = next_prefix(prefix)
+        if upper is None:
+            condition |= Q(geohash__gte=prefix)
+        else:
+            condition |= Q(geohash__gte=prefix, geohash__lt=upper)
+    return condition
+
+
+def next_prefix(prefix):
+    """
+    The smallest geohash prefix sorting after every hash that starts with
+    ``prefix``: its last character bumped to the next base32 character,
+    carrying over 'z'. None when there is none ('zz...').
+    """
+    prefix = prefix.rstrip(BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[BASE32.index(prefix[-1]) + 1]
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """
+    (south, west, north, east) of a box containing the circle.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    if cos_lat < 1e-6 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        return south, -180.0, north, 180.0
+    dlng = radius_km / (KM_PER_DEGREE * cos_lat)
+    west, east = longitude - dlng, longitude + dlng
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+
+def within_bbox(queryset, south, west, north, east):
+    queryset = queryset.filter(
+        geohash_condition(cover_bbox(south, west, north, east)),
+        latitude__gte=south,
+        latitude__lte=north,
+    )
+    if west > east:
+        return queryset.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+    return queryset.filter(longitude__gte=west, longitude__lte=east)
+
+
+def distance_expression(latitude, longitude):
+    """
+    Haversine distance in km from (latitude, longitude) to each row.
+    """
+    lat, lng = math.radians(latitude), math.radians(longitude)
+    half_dlat = Sin((Radians(F('latitude')) - Value(lat)) / 2)
+    half_dlng = Sin((Radians(F('longitude')) - Value(lng)) / 2)
+    a = Power(half_dlat, 2) + Value(math.cos(lat)) * Cos(Radians(F('latitude'))) * Power(half_dlng, 2)
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a), output_field=FloatField())
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """
+    Rows within ``radius_km`` of the point, annotated with distance_km.
+    """
+    queryset = within_bbox(queryset, *radius_bbox(latitude, longitude, radius_km))
+    return queryset.annotate(
+        distance_km=distance_expression(latitude, longitude)
+    ).filter(distance_km__lte=radius_km)
+
+
+# -----------------------
+# Gazetteer geocoding
+# -----------------------
+
+def normalize_place(name):
+    return re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+
+
+def load_gazetteer(path):
+    """
+    Read a CSV gazetteer into {normalized name: (latitude, longitude)}.
+
+    Columns: name, latitude, longitude and optionally alternate_names
+    (separated by "|"). A header row is skipped. The first entry for a
+    name wins, so list the most prominent place first.
+    """
+    places = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or not row[0].strip():
+                continue
+            try:
+                point = (float(row[1]), float(row[2]))
+            except ValueError:
+                continue  # header or malformed row
+            names = [row[0]] + (row[3].split('|') if len(row) > 3 else [])
+            for name in names:
+                places.setdefault(normalize_place(name), point)
+    return places
+
+
+def geocode(location, places):
+    """
+    Look ``location`` up in a gazetteer: the whole string first, then each
+    comma-separated part from the most specific ("Lekki Phase 1, Lagos"
+    tries "lekki phase 1" before "lagos"). Returns (lat, lng) or None.
+    """
+    candidates = [location] + location.split(',')
+    for candidate in candidates:
+        point = places.get(normalize_place(candidate))
+        if point is not None:
+            return point
+    return None
@@ -0,0 +1,179 @@
+"""
+Resized WebP/JPEG derivatives of listing photos.
+
+Originals are stored as listings.uploads.process_photo re-encoded them
+(upright, size-capped JPEG without EXIF); after a listing is committed,
+any photo without up-to-date variants is resized off the request path on a
+small thread pool (Pillow releases the GIL while decoding, resizing and
+encoding). The variant names are recorded in Listing.photo_variants and
+exposed by the serializers as srcset strings.
+
+LISTING_IMAGE_VARIANTS picks where builds run: 'background' (the pool),
+'inline' (in the committing thread, for scripts and tests) or 'off'.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+PHOTO_FIELDS = ('main_photo', 'photo_1', 'photo_2', 'photo_3')
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.LISTING_IMAGE_WORKERS,
+            thread_name_prefix='listing-images',
+        )
+    return _executor
+
+
+def stale_photo_fields(listing):
+    """
+    Photo fields whose recorded variants don't belong to the current file.
+    """
+    variants = listing.photo_variants or {}
+    return [
+        name for name in PHOTO_FIELDS
+        if getattr(listing, name) and variants.get(name, {}).get('source') != getattr(listing, name).name
+    ]
+
+
+def schedule_variants(listing, using=None):
+    """
+    Queue variant generation for ``listing`` once the current transaction
+    commits.
+    """
+    mode = settings.LISTING_IMAGE_VARIANTS
+    if mode == 'off' or not stale_photo_fields(listing):
+        return
+    pk = listing.pk
+    if mode == 'inline':
+        transaction.on_commit(lambda: _build(pk), using=using)
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run, pk), using=using)
+
+
+def _run(pk):
+    close_old_connections()
+    try:
+        _build(pk)
+    finally:
+        close_old_connections()
+
+
+def _build(pk):
+    try:
+        build_variants(pk)
+    except Exception:
+        logger.exception('Could not build photo variants for listing %s', pk)
+
+
+def derived_name(name, digest, width, ext):
+    """
+    Storage name of one variant of the photo stored as ``name`` whose
+    content hashes to ``digest``. The whole source name goes in, so
+    a.png and a.jpg don't share variants, and so does the digest, so a
+    new photo stored under a freed name doesn't either.
+    """
+    directory, base = os.path.split(name)
+    return os.path.join(directory, 'derived', f'{base}-{digest}-{width}w.{ext}')
+
+
+def variant_names(entry):
+    """
+    Storage names recorded in one photo_variants entry.
+    """
+    return [name for ext in FORMATS for name in entry.get(ext, {}).values()]
+
+
+def build_variants(pk):
+    """
+    Generate missing variants for listing ``pk`` and record them. Variants
+    of a replaced photo are queued for deletion.
+    """
+    from .cache import invalidate_listings
+    from .cleanup import queue_file_deletion
+    from .models import Listing
+    from .readmodel import sync_published
+
+    listing = Listing.objects.filter(pk=pk).first()
+    if listing is None:
+        return
+    stale = stale_photo_fields(listing)
+    if not stale:
+        return
+
+    variants = dict(listing.photo_variants or {})
+    orphaned = []
+    for field in stale:
+        photo = getattr(listing, field)
+        orphaned.extend(variant_names(variants.get(field, {})))
+        variants[field] = {'source': photo.name, **render_variants(photo)}
+
+    current = {name for entry in variants.values() for name in variant_names(entry)}
+    with transaction.atomic():
+        Listing.objects.filter(pk=pk).update(photo_variants=variants)
+        sync_published([pk])
+        queue_file_deletion([name for name in orphaned if name not in current])
+    invalidate_listings([listing.slug])
+
+
+def render_variants(photo):
+    """
+    Write each configured width/format of ``photo`` to storage and return
+    {format: {width: name}}. Widths wider than the original are skipped
+    (a small original gets a single variant at its own width). Files are
+    always written; the storage picks a free name if one is taken.
+    """
+    storage = photo.storage
+    widths = sorted(settings.LISTING_IMAGE_WIDTHS)
+    result = {ext: {} for ext in FORMATS}
+
+    with storage.open(photo.name, 'rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+
+    with Image.open(BytesIO(data)) as image:
+        # Let the JPEG decoder downscale while decoding when it can. The box
+        # is square so the result is still wide enough after EXIF rotation.
+        image.draft('RGB', (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        for width in [w for w in widths if w <= image.width] or [image.width]:
+            resized = image.copy()
+            resized.thumbnail((width, width * 4), Image.LANCZOS)
+            for ext, (pil_format, options) in FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, **options)
+                name = storage.save(derived_name(photo.name, digest, width, ext), ContentFile(buffer.getvalue()))
+                result[ext][str(width)] = name
+    return result
+
+
+def srcset(storage, widths):
+    """
+    Build an HTML srcset value from {width: name}.
+    """
+    return ', '.join(
+        f'{storage.url(name)} {width}w'
+        for width, name in sorted(widths.items(), key=lambda item: int(item[0]))
+    )
@@ -0,0 +1,468 @@
+import asyncio
+import importlib
+import json
+import random
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode, urlsplit
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import clear_url_caches
+
+from listings.cache import get_cache
+from listings.management.commands.bench_serializers import seed_listings, seed_realtors, test_database
+
+BENCH_PASSWORD = 'benchmark-password'
+
+BENCH_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-default'},
+    'listings': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-listings',
+                 'OPTIONS': {'MAX_ENTRIES': 100000}},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-users'},
+}
+
+_queries = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the listings API with concurrent clients and report latency '
+        'percentiles, throughput and queries per request. By default seeds a '
+        'throwaway test database and calls the app in-process; --base-url drives '
+        'a running server instead. --interfaces wsgi asgi runs the same load '
+        'through both handlers to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                            help='Catalogue sizes to seed and test (in-process mode).')
+        parser.add_argument('--realtors', type=int, default=200)
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent clients.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=None)
+        parser.add_argument('--cold', action='store_true',
+                            help='Make every request miss the response cache.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for request parameters.')
+        parser.add_argument('--interfaces', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi'],
+                            help='In-process handlers to run the load through.')
+        parser.add_argument('--server-threads', type=int, default=None,
+                            help='WSGI only: at most this many requests in flight at once, like '
+                                 'gunicorn threads (default: one per client).')
+        parser.add_argument('--slow-client-ms', type=float, default=0,
+                            help='Time each client takes to read its response. A WSGI thread '
+                                 'is held for it; under ASGI the event loop serves others.')
+        parser.add_argument('--base-url', help='Benchmark a running server, e.g. http://localhost:8000.')
+        parser.add_argument('--email', help='Realtor login for the authenticated scenarios (--base-url).')
+        parser.add_argument('--password', help='Password for --email.')
+        parser.add_argument('--baseline', help='Compare against results saved with --save-baseline.')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95/throughput change before flagging a regression (0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'] or list(SCENARIOS)
+        results = {}
+        if options['base_url']:
+            transport = HttpTransport(options['base_url'])
+            credentials = (options['email'], options['password']) if options['email'] else None
+            results['server'] = self.run_scenarios(transport, scenarios, credentials, options)
+        else:
+            with test_database(), override_settings(
+                CACHES=BENCH_CACHES, REQUEST_METRICS_ENABLED=True, ALLOWED_HOSTS=['*'],
+                LISTING_FILE_CLEANUP_ON_COMMIT=False, EMAIL_OUTBOX_DISPATCH_ON_COMMIT=False,
+            ):
+                realtors = seed_realtors(options['realtors'], BENCH_PASSWORD)
+                credentials = (realtors[0].email, BENCH_PASSWORD)
+                for size in sorted(options['sizes']):
+                    self.stdout.write(f'Seeding {size} listings...')
+                    seed_listings(realtors, size)
+                    for name in options['interfaces']:
+                        # WSGI keeps the plain size as its key, so older
+                        # baselines still compare.
+                        key = str(size) if name == 'wsgi' else f'{size}-{name}'
+                        self.stdout.write(f'[{name}]')
+                        # Each interface starts from a cold response cache.
+                        get_cache().clear()
+                        with interface(name):
+                            transport = (
+                                AsgiTransport(options['slow_client_ms']) if name == 'asgi'
+                                else InProcessTransport(options['slow_client_ms'], options['server_threads'])
+                            )
+                            results[key] = self.run_scenarios(transport, scenarios, credentials, options)
+                    if len(options['interfaces']) > 1:
+                        self.compare_interfaces(results, size)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved baseline to {options['save_baseline']}.")
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def run_scenarios(self, transport, scenarios, credentials, options):
+        rng = random.Random(options['seed'])
+        context = prepare(transport, credentials)
+        self.stdout.write(
+            f"{'scenario':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'q/req':>6} {'errors':>6}"
+        )
+        results = {}
+        for name in scenarios:
+            scenario = SCENARIOS[name]
+            if scenario.get('auth') and not context.get('token'):
+                self.stdout.write(f'{name:<16} skipped (no credentials)')
+                continue
+            requests = [scenario['build'](context, rng) for _ in range(options['requests'])]
+            if options['cold']:
+                requests = [
+                    (method, _with_param(path, '_bench', i), data, auth)
+                    for i, (method, path, data, auth) in enumerate(requests)
+                ]
+            if isinstance(transport, AsgiTransport):
+                stats = asyncio.run(run_async_load(transport, requests, options['clients'], context.get('token')))
+            else:
+                stats = run_load(transport, requests, options['clients'], context.get('token'))
+            results[name] = stats
+            self.stdout.write(
+                f"{name:<16} {stats['p50']:>8.1f} {stats['p95']:>8.1f} {stats['p99']:>8.1f} "
+                f"{stats['throughput']:>8.1f} {_fmt(stats['queries']):>6} {stats['errors']:>6}"
+            )
+        return results
+
+    def compare_interfaces(self, results, size):
+        wsgi, asgi = results.get(str(size), {}), results.get(f'{size}-asgi', {})
+        for name in wsgi.keys() & asgi.keys():
+            ratio = asgi[name]['throughput'] / wsgi[name]['throughput']
+            self.stdout.write(
+                f"{name:<16} asgi/wsgi throughput {ratio:.2f}x, "
+                f"p95 {wsgi[name]['p95']:.1f} -> {asgi[name]['p95']:.1f} ms"
+            )
+
+    def compare(self, results, path, tolerance):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read baseline: {e}')
+
+        regressions = []
+        for size, scenarios in results.items():
+            for name, stats in scenarios.items():
+                before = baseline.get(size, {}).get(name)
+                if before is None:
+                    continue
+                if stats['p95'] > before['p95'] * (1 + tolerance):
+                    regressions.append(f"{size}/{name}: p95 {before['p95']:.1f} -> {stats['p95']:.1f} ms")
+                if stats['throughput'] < before['throughput'] * (1 - tolerance):
+                    regressions.append(
+                        f"{size}/{name}: throughput {before['throughput']:.1f} -> {stats['throughput']:.1f} req/s"
+                    )
+                # Cache hits make this fractional; half a query more per
+                # request on average is a real change.
+                if (stats['queries'] or 0) > (before['queries'] or 0) + 0.5:
+                    regressions.append(
+                        f"{size}/{name}: queries/request {_fmt(before['queries'])} -> {_fmt(stats['queries'])}"
+                    )
+                if stats['errors'] > before['errors']:
+                    regressions.append(f"{size}/{name}: errors {before['errors']} -> {stats['errors']}")
+
+        if regressions:
+            for line in regressions:
+                self.stderr.write(self.style.ERROR(line))
+            raise CommandError(f'{len(regressions)} regressions against {path}.')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {path}.'))
+
+
+# -----------------------
+# Scenarios
+# -----------------------
+
+@contextmanager
+def interface(name):
+    """
+    Route the listing reads the way settings.ASGI would for ``name``; the
+    URLconf picks its views at import, so it is reloaded around the run.
+    """
+    import listings.urls
+    import realestate.urls
+
+    def reload():
+        importlib.reload(listings.urls)
+        importlib.reload(realestate.urls)
+        clear_url_caches()
+
+    try:
+        with override_settings(ASGI=name == 'asgi'):
+            reload()
+            yield
+    finally:
+        reload()
+
+
+def prepare(transport, credentials):
+    """
+    Collect slugs and a cursor to build requests from, and log in.
+    """
+    if isinstance(transport, AsgiTransport):
+        transport = SyncAdapter(transport)
+    status, headers, body = transport.request('GET', '/api/listings/get-listings?page_size=100')
+    if status != 200:
+        raise CommandError(f'get-listings returned {status}; is the catalogue empty?')
+    page = json.loads(body)
+    context = {
+        'slugs': [listing['slug'] for listing in page['listings']],
+        'next': urlsplit(page['next']).path + '?' + urlsplit(page['next']).query if page['next'] else None,
+        'credentials': credentials,
+    }
+    if credentials:
+        status, _, body = transport.request(
+            'POST', '/api/token/', {'email': credentials[0], 'password': credentials[1]}
+        )
+        if status == 200:
+            context['token'] = json.loads(body)['access']
+    return context
+
+
+def _with_param(path, name, value):
+    return f"{path}{'&' if '?' in path else '?'}{urlencode({name: value})}"
+
+
+def _get(path, auth=False):
+    return ('GET', path, None, auth)
+
+
+SCENARIOS = {
+    'feed': {'build': lambda ctx, rng: _get('/api/listings/get-listings')},
+    'feed-page-2': {'build': lambda ctx, rng: _get(ctx['next'] or '/api/listings/get-listings')},
+    'detail': {'auth': True, 'build': lambda ctx, rng: _get(
+        f"/api/listings/detail?slug={rng.choice(ctx['slugs'])}", auth=True
+    )},
+    'search-text': {'build': lambda ctx, rng: _get(
+        '/api/listings/search?' + urlencode({'search': rng.choice(['garden', 'spacious home', 'listing'])})
+    )},
+    'search-filter': {'build': lambda ctx, rng: _get('/api/listings/search?' + urlencode({
+        'category': rng.choice(['FOR_SALE', 'FOR_RENT']),
+        'bedrooms': rng.randint(1, 4),
+        'max_price': rng.randint(20000, 200000),
+    }))},
+    'search-nearby': {'build': lambda ctx, rng: _get('/api/listings/search?' + urlencode({
+        'lat': round(rng.uniform(6.35, 6.65), 4),
+        'lng': round(rng.uniform(3.15, 3.65), 4),
+        'radius_km': rng.choice([1, 3, 5]),
+    }))},
+    'facets': {'build': lambda ctx, rng: _get('/api/listings/search/facets?' + urlencode({
+        'category': rng.choice(['FOR_SALE', 'FOR_RENT', '']),
+        'min_price': rng.choice(['', 20000, 50000]),
+    }))},
+    'manage': {'auth': True, 'build': lambda ctx, rng: _get('/api/listings/manage', auth=True)},
+    'user-me': {'auth': True, 'build': lambda ctx, rng: _get('/api/users/me/', auth=True)},
+    'token': {'auth': True, 'build': lambda ctx, rng: (
+        'POST', '/api/token/', {'email': ctx['credentials'][0], 'password': ctx['credentials'][1]}, False
+    )},
+}
+
+
+# -----------------------
+# Load generation
+# -----------------------
+
+def run_load(transport, requests, clients, token):
+    latencies, queries, errors = [], [], 0
+    lock = threading.Lock()
+
+    def worker(batch):
+        nonlocal errors
+        try:
+            for method, path, data, auth in batch:
+                start = time.perf_counter()
+                status, headers, _ = transport.request(method, path, data, token if auth else None)
+                elapsed = (time.perf_counter() - start) * 1000
+                match = _queries.search(headers.get('Server-Timing', ''))
+                with lock:
+                    latencies.append(elapsed)
+                    if match:
+                        queries.append(int(match.group(1)))
+                    # A 404 is the API's "no listings match", not a failure.
+                    if status >= 400 and status != 404:
+                        errors += 1
+        finally:
+            transport.close()
+
+    batches = [requests[i::clients] for i in range(clients)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(worker, batches))
+    return summarize(latencies, queries, errors, time.perf_counter() - start)
+
+
+async def run_async_load(transport, requests, clients, token):
+    """
+    run_load() for AsgiTransport: one task per client on one event loop.
+    """
+    latencies, queries, errors = [], [], 0
+
+    async def worker(batch):
+        nonlocal errors
+        for method, path, data, auth in batch:
+            start = time.perf_counter()
+            status, headers, _ = await transport.request(method, path, data, token if auth else None)
+            latencies.append((time.perf_counter() - start) * 1000)
+            match = _queries.search(headers.get('Server-Timing', ''))
+            if match:
+                queries.append(int(match.group(1)))
+            if status >= 400 and status != 404:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(requests[i::clients]) for i in range(clients)))
+    return summarize(latencies, queries, errors, time.perf_counter() - start)
+
+
+def summarize(latencies, queries, errors, wall):
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'p50': quantiles[49],
+        'p95': quantiles[94],
+        'p99': quantiles[98],
+        'throughput': len(latencies) / wall,
+        'queries': statistics.mean(queries) if queries else None,
+        'errors': errors,
+    }
+
+
+def _fmt(value):
+    return '-' if value is None else f'{value:.1f}'
+
+
+class InProcessTransport:
+    """
+    Calls the WSGI handler directly through django.test.Client, one client
+    (and DB connection) per thread. ``server_threads`` caps how many
+    requests are in flight at once; a slow client holds its slot while it
+    reads the response, as it holds a gunicorn thread.
+    """
+
+    def __init__(self, slow_client_ms=0, server_threads=None):
+        self.local = threading.local()
+        self.slow = slow_client_ms / 1000
+        self.slots = threading.BoundedSemaphore(server_threads) if server_threads else None
+
+    def request(self, method, path, data=None, token=None):
+        if self.slots is None:
+            return self._request(method, path, data, token)
+        with self.slots:
+            return self._request(method, path, data, token)
+
+    def _request(self, method, path, data, token):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        if method == 'POST':
+            response = client.post(path, data, content_type='application/json', headers=headers)
+        else:
+            response = client.get(path, headers=headers)
+        body = b'' if response.streaming else response.content
+        if self.slow:
+            time.sleep(self.slow)
+        return response.status_code, response.headers, body
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def close(self):
+        pass
+
+
+class AsgiTransport:
+    """
+    Drives Django's ASGIHandler the way an ASGI server does: one scope and
+    receive/send pair per request. A slow client is an ``await`` in send,
+    so the event loop serves other requests meanwhile.
+    """
+
+    def __init__(self, slow_client_ms=0):
+        self.application = ASGIHandler()
+        self.slow = slow_client_ms / 1000
+
+    async def request(self, method, path, data=None, token=None):
+        parts = urlsplit(path)
+        body = json.dumps(data).encode() if data else b''
+        headers = [
+            (b'host', b'testserver'), (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ]
+        if token:
+            headers.append((b'authorization', f'Bearer {token}'.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': parts.path, 'raw_path': parts.path.encode(),
+            'query_string': parts.query.encode(), 'headers': headers,
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body}]
+        finished = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        status, response_headers, chunks = None, {}, []
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                response_headers.update((k.decode().title(), v.decode()) for k, v in message['headers'])
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                if self.slow and not message.get('more_body'):
+                    await asyncio.sleep(self.slow)
+
+        try:
+            await self.application(scope, receive, send)
+        finally:
+            finished.set()
+        return status, response_headers, b''.join(chunks)
+
+    def close(self):
+        pass
+
+
+class SyncAdapter:
+    """
+    AsgiTransport for the sync setup code in prepare().
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def request(self, method, path, data=None, token=None):
+        return asyncio.run(self.transport.request(method, path, data, token))
@@ -0,0 +1,124 @@
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+
+from listings.models import Listing
+from listings.readmodel import sync_published
+from listings.serializers import ListingListSerializer, ListingValuesSerializer
+from users.models import UserAccount
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the DRF ListingListSerializer with the values() fast path. '
+        'Runs against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument(
+            '--all-fields', action='store_true',
+            help='Render every listing field instead of the compact list fields.',
+        )
+
+    def handle(self, *args, **options):
+        fields = tuple(ListingListSerializer.all_fields()) if options['all_fields'] else None
+        with test_database():
+            realtors = seed_realtors(1)
+            self.stdout.write(f"{'rows':>8} {'drf (s)':>10} {'fast (s)':>10} {'speedup':>8}")
+            for size in sorted(options['sizes']):
+                seed_listings(realtors, size)
+                queryset = Listing.objects.order_by('-created_at', '-id')[:size]
+                drf_time, drf_json = best_of(options['repeat'], lambda: render_drf(queryset, fields))
+                fast_time, fast_json = best_of(options['repeat'], lambda: render_fast(queryset, fields))
+                if drf_json != fast_json:
+                    self.stderr.write(self.style.ERROR(f'Output differs at {size} rows.'))
+                self.stdout.write(
+                    f'{size:>8} {drf_time:>10.3f} {fast_time:>10.3f} {drf_time / fast_time:>7.1f}x'
+                )
+
+
+def render_drf(queryset, fields):
+    rows = queryset.only(*ListingListSerializer.model_fields(fields))
+    return JSONRenderer().render(ListingListSerializer(rows, many=True, fields=fields).data)
+
+
+def render_fast(queryset, fields):
+    rows = queryset.values(*ListingListSerializer.model_fields(fields))
+    return JSONRenderer().render(ListingValuesSerializer(fields).serialize(rows))
+
+
+def best_of(repeat, func):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def seed_realtors(count, password='benchmark-password'):
+    """
+    ``count`` realtor accounts (bench0@example.com, ...) sharing one
+    password hash. bulk_create skips the signal that creates a
+    RealtorProfile, which the listing endpoints don't need.
+    """
+    existing = list(UserAccount.objects.filter(email__startswith='bench').order_by('id'))
+    hashed = make_password(password)
+    UserAccount.objects.bulk_create([
+        UserAccount(email=f'bench{i}@example.com', name=f'Bench {i}', role='realtor',
+                    password=hashed, is_active=True)
+        for i in range(len(existing), count)
+    ])
+    return list(UserAccount.objects.filter(email__startswith='bench').order_by('id'))
+
+
+def seed_listings(realtors, total, batch_size=5000):
+    """
+    Grow the catalogue to ``total`` published listings spread across
+    ``realtors``, with coordinates scattered around Lagos.
+    """
+    existing = Listing.objects.count()
+    categories = [choice for choice, _ in Listing.CategoryChoices.choices]
+    for start in range(existing, total, batch_size):
+        listings = [
+            Listing(
+                realtor=realtors[i % len(realtors)],
+                realtor_email=realtors[i % len(realtors)].email,
+                title=f'Bench listing {i}',
+                slug=f'bench-listing-{i}',
+                description='Spacious home with a garden. ' * 10,
+                price=Decimal(50000 + i * 7) / 4,
+                location=f'Area {i % 97}',
+                latitude=6.3 + (i * 7919 % 4000) / 10000,
+                longitude=3.1 + (i * 104729 % 6000) / 10000,
+                bedrooms=i % 6,
+                bathrooms=Decimal(i % 5) / 2,
+                category=categories[i % len(categories)],
+                main_photo=f'listings/bench-{i}.jpg',
+                photo_1=f'listings/bench-{i}-1.jpg' if i % 2 else None,
+                is_published=True,
+            )
+            for i in range(start, min(start + batch_size, total))
+        ]
+        for listing in listings:
+            listing.update_geohash()
+        Listing.objects.bulk_create(listings)
+        sync_published([listing.pk for listing in listings])
+
+
+@contextmanager
+def test_database():
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
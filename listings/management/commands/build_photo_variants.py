@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from listings.images import build_variants, stale_photo_fields
+from listings.models import Listing
+
+
+class Command(BaseCommand):
+    help = 'Build missing resized photo variants for existing listings.'
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        for listing in Listing.objects.only('id', 'slug', 'photo_variants', 'main_photo',
+                                            'photo_1', 'photo_2', 'photo_3').iterator():
+            if not stale_photo_fields(listing):
+                continue
+            try:
+                build_variants(listing.pk)
+                built += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{listing.slug}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Built variants for {built} listings ({failed} failed).'))
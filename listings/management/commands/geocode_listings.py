@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from listings.cache import invalidate_listings
+from listings.geo import geocode, load_gazetteer
+from listings.models import Listing
+from listings.readmodel import sync_published
+
+
+class Command(BaseCommand):
+    help = 'Fill in listing coordinates from a local gazetteer CSV (name, latitude, longitude[, alternate_names]).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gazetteer', default=settings.LISTING_GAZETTEER,
+                            help='Path to the gazetteer CSV (default: settings.LISTING_GAZETTEER).')
+        parser.add_argument('--all', action='store_true', help='Re-geocode listings that already have coordinates.')
+        parser.add_argument('--dry-run', action='store_true', help='Report matches without saving them.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            places = load_gazetteer(options['gazetteer'])
+        except OSError as e:
+            raise CommandError(f'Could not read gazetteer: {e}')
+
+        listings = Listing.objects.only('id', 'slug', 'location', 'latitude', 'longitude', 'geohash')
+        if not options['all']:
+            listings = listings.filter(latitude__isnull=True)
+
+        batch, slugs, matched, missed = [], [], 0, 0
+        for listing in listings.iterator(chunk_size=options['batch_size']):
+            point = geocode(listing.location, places)
+            if point is None:
+                missed += 1
+                self.stderr.write(f'{listing.slug}: no match for "{listing.location}"')
+                continue
+            matched += 1
+            listing.latitude, listing.longitude = point
+            listing.update_geohash()
+            batch.append(listing)
+            if len(batch) >= options['batch_size']:
+                slugs += self.save(batch, options['dry_run'])
+                batch = []
+        slugs += self.save(batch, options['dry_run'])
+
+        if slugs:
+            invalidate_listings(slugs)
+        self.stdout.write(self.style.SUCCESS(f'Geocoded {matched} listings ({missed} without a match).'))
+
+    def save(self, listings, dry_run):
+        if dry_run or not listings:
+            return []
+        with transaction.atomic():
+            Listing.objects.bulk_update(listings, ['latitude', 'longitude', 'geohash'])
+            sync_published([listing.pk for listing in listings])
+        return [listing.slug for listing in listings]
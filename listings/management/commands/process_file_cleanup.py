@@ -0,0 +1,11 @@
+from listings.cleanup import delete_pending
+from realestate.queue import QueueCommand
+
+
+class Command(QueueCommand):
+    help = 'Delete queued orphaned listing files from storage.'
+    noun = 'files'
+    default_interval = 30.0
+
+    def process(self, batch_size):
+        return delete_pending(batch_size)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from listings.cache import invalidate_listings
+from listings.readmodel import rebuild_published
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the published-listing read model from the listings table. '
+        'Run after changing how listings render; migrations backfill the table on first deploy.'
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild_published()
+        invalidate_listings()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} published listings.'))
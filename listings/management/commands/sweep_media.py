@@ -0,0 +1,50 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from listings.cleanup import get_storage, queue_file_deletion
+from listings.images import PHOTO_FIELDS
+from listings.models import Listing, PendingFileDeletion
+
+
+class Command(BaseCommand):
+    help = 'Queue files under MEDIA_ROOT that no listing references for deletion.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=float, default=24.0,
+            help='Only consider files older than this many hours, so uploads whose '
+                 'transaction has not committed yet are left alone.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='List orphaned files without queueing them.')
+
+    def handle(self, *args, **options):
+        storage = get_storage()
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+
+        referenced = set(PendingFileDeletion.objects.values_list('name', flat=True))
+        for listing in Listing.objects.only(*PHOTO_FIELDS, 'photo_variants').iterator(chunk_size=2000):
+            referenced.update(listing.stored_file_names())
+
+        if not storage.exists(''):
+            self.stdout.write('Nothing to sweep.')
+            return
+        orphaned = [
+            name for name in self.walk(storage, '')
+            if name not in referenced and storage.get_modified_time(name) < cutoff
+        ]
+        for name in orphaned:
+            self.stdout.write(name)
+        if not options['dry_run']:
+            queue_file_deletion(orphaned)
+        verb = 'Found' if options['dry_run'] else 'Queued'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(orphaned)} unreferenced files.'))
+
+    def walk(self, storage, path):
+        directories, files = storage.listdir(path)
+        for name in files:
+            yield os.path.join(path, name).replace(os.sep, '/')
+        for directory in directories:
+            yield from self.walk(storage, os.path.join(path, directory))
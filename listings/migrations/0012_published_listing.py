@@ -0,0 +1,64 @@
+# Generated by Django 6.0 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_listing_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishedListing',
+            fields=[
+                ('id', models.OneToOneField(db_column='id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='published', serialize=False, to='listings.listing')),
+                ('slug', models.SlugField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('location', models.CharField(max_length=255)),
+                ('latitude', models.FloatField(null=True)),
+                ('longitude', models.FloatField(null=True)),
+                ('geohash', models.CharField(blank=True, default='', max_length=12)),
+                ('bedrooms', models.IntegerField()),
+                ('bathrooms', models.DecimalField(decimal_places=1, max_digits=2)),
+                ('category', models.CharField(choices=[('FOR_SALE', 'For Sale'), ('FOR_RENT', 'For Rent'), ('FOR_BUY', 'For Buy')], max_length=20)),
+                ('search_text', models.TextField()),
+                ('payload', models.JSONField()),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listing_pub_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listing_pub_category_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listing_pub_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listing_pub_geohash_idx',
+        ),
+        migrations.AddIndex(
+            model_name='publishedlisting',
+            index=models.Index(fields=['-created_at', '-id'], name='published_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='publishedlisting',
+            index=models.Index(fields=['category', 'price'], name='published_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='publishedlisting',
+            index=models.Index(fields=['price'], name='published_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='publishedlisting',
+            index=models.Index(fields=['geohash'], name='published_geohash_idx'),
+        ),
+    ]
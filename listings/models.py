@@ -1,6 +1,20 @@
 from django.conf import settings
-from django.db import models, IntegrityError, transaction
-from django.utils.text import slugify
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, router, IntegrityError, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import invalidate_listings, invalidate_on_commit
+from .cleanup import queue_file_deletion
+from .geo import encode_geohash
+from .images import PHOTO_FIELDS, schedule_variants, variant_names
+from .readmodel import sync_published
+from .slugs import allocate_slugs
+
+# Allocation only fails when another request takes the same slug between
+# our lookup and insert, so each retry means another save of the same title won.
+SLUG_ATTEMPTS = 25
 
 
 class Listing(models.Model):
@@ -19,6 +33,11 @@ class Listing(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=12, decimal_places=2)
     location = models.CharField(max_length=255)
+    # Filled in by the API or the geocode_listings command; geohash is
+    # derived from them on save (see listings/geo.py).
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     bedrooms = models.IntegerField(default=0)
     bathrooms = models.DecimalField(max_digits=2,decimal_places=1, default=0.0)
     category = models.CharField(max_length=20, choices=CategoryChoices.choices, default=CategoryChoices.FOR_SALE)
@@ -28,35 +47,61 @@ class Listing(models.Model):
     photo_2 = models.ImageField(upload_to='listings/', blank=True, null=True)  
     photo_3 = models.ImageField(upload_to='listings/', blank=True, null=True)
     is_published = models.BooleanField(default=False)
+    # Resized derivatives of the photos, filled in by listings.images:
+    # {field: {'source': name, 'webp': {width: name}, 'jpeg': {width: name}}}
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
 
+    class Meta:
+        indexes = [
+            # Realtor dashboard: WHERE realtor_id = ? ORDER BY created_at DESC
+            models.Index(fields=['realtor', '-created_at'], name='listing_realtor_created_idx'),
+        ]
 
-    def delete(self, using=None, keep_parents=False):
-        if self.main_photo:
-          self.main_photo.storage.delete(self.main_photo.name)
-
-        if self.photo_1:
-          self.photo_1.storage.delete(self.photo_1.name)
-
-        if self.photo_2:
-          self.photo_2.storage.delete(self.photo_2.name)
-
-        if self.photo_3:
-          self.photo_3.storage.delete(self.photo_3.name)
-
-        super().delete(using=using, keep_parents=keep_parents)
+    def stored_file_names(self):
+        """
+        Storage names of this listing's photos and their derived variants.
+        """
+        names = [
+            getattr(self, field).name for field in PHOTO_FIELDS if getattr(self, field)
+        ]
+        for entry in (self.photo_variants or {}).values():
+            names.extend(variant_names(entry))
+        return names
 
+    def update_geohash(self):
+        if self.latitude is None or self.longitude is None:
+            self.geohash = ''
+        else:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
 
     def save(self, *args, **kwargs):
+      self.update_geohash()
+      update_fields = kwargs.get('update_fields')
+      if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+          kwargs['update_fields'] = {*update_fields, 'geohash'}
+      using = kwargs.get('using') or router.db_for_write(Listing, instance=self)
+      with transaction.atomic(using=using):
+        self._save_row(args, kwargs, using)
+        # Publish, unpublish or re-render this listing's read model row
+        # in the same transaction as the change itself.
+        sync_published([self.pk], using=using)
+      transaction.on_commit(lambda: invalidate_listings([self.slug]), using=kwargs.get('using'))
+      schedule_variants(self, using=kwargs.get('using'))
+
+    def _save_row(self, args, kwargs, using):
       if not self.slug:
-        base_slug = slugify(self.title)
-        for i in range(100):
-            self.slug = base_slug if i == 0 else f"{base_slug}-{i}"
+        # The allocator finds the next free suffix in one query, so the only
+        # way to collide is a concurrent insert of the same slug; when that
+        # happens, allocate again (the winner's row is visible by then).
+        for _ in range(SLUG_ATTEMPTS):
+            self.slug = allocate_slugs(Listing, [self.title], using=using)[0]
             try:
-                with transaction.atomic():
+                with transaction.atomic(using=using):
                     super().save(*args, **kwargs)
-                    break  # Exit loop after successful save
+                break
             except IntegrityError:
-                continue
+                if not Listing._default_manager.using(using).filter(slug=self.slug).exists():
+                    raise
         else:
             raise IntegrityError("Could not generate a unique slug")
       else:
@@ -66,3 +111,76 @@ class Listing(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class PublishedListing(models.Model):
+    """
+    Read model for the public endpoints: one row per published listing
+    holding its rendered API representation (``payload``), its search
+    text and the columns the feed and search filter and sort on. Kept in
+    step with Listing by listings.readmodel.
+    """
+    # Named id so rows, cursors and orderings read the same as Listing's.
+    id = models.OneToOneField(
+        Listing, on_delete=models.CASCADE, primary_key=True, db_column='id', related_name='published'
+    )
+    slug = models.SlugField(max_length=255, unique=True)
+    created_at = models.DateTimeField()
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    location = models.CharField(max_length=255)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    geohash = models.CharField(max_length=12, blank=True, default='')
+    bedrooms = models.IntegerField()
+    bathrooms = models.DecimalField(max_digits=2, decimal_places=1)
+    category = models.CharField(max_length=20, choices=Listing.CategoryChoices.choices)
+    search_text = models.TextField()
+    # ListingSerializer(listing).data; list views pick their fields from it.
+    payload = models.JSONField()
+
+    class Meta:
+        indexes = [
+            # Feed / search: ORDER BY created_at DESC, id DESC
+            models.Index(fields=['-created_at', '-id'], name='published_created_idx'),
+            # Search by category with a price range
+            models.Index(fields=['category', 'price'], name='published_category_price_idx'),
+            # Search with only a price range
+            models.Index(fields=['price'], name='published_price_idx'),
+            # Bounding box / radius search: geohash prefix range scans
+            models.Index(fields=['geohash'], name='published_geohash_idx'),
+        ]
+
+    def __str__(self):
+        return self.slug
+
+
+class PendingFileDeletion(models.Model):
+    """
+    A stored file that no listing uses any more, waiting to be removed
+    from storage by listings.cleanup.
+    """
+    name = models.CharField(max_length=500)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='file_deletion_due_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, using, **kwargs):
+    # Runs for every way a listing goes: instance and queryset deletes,
+    # the admin's bulk action and the cascade from its realtor's account.
+    # The files are queued in the deleting transaction and removed by
+    # listings.cleanup once it commits, so a rollback keeps them and the
+    # request doesn't wait on storage. The PublishedListing row goes with
+    # the listing (its key cascades).
+    queue_file_deletion(instance.stored_file_names(), using=using)
+    invalidate_on_commit([instance.slug], using=using)
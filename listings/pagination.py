@@ -0,0 +1,189 @@
+import base64
+import datetime
+import decimal
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPagination:
+    """
+    Cursor pagination keyed on the queryset ordering (by default
+    -created_at, -id).
+
+    Each page is fetched with a WHERE clause on the last seen sort key
+    instead of an OFFSET, so deep pages cost the same as the first one.
+    Cursors are opaque base64 tokens; clients just follow next/previous.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        self.next_cursor = None
+        self.previous_cursor = None
+        self.is_first_page = True
+
+    def get_page_size(self, request):
+        value = request.GET.get(self.page_size_query_param)
+        if not value:
+            return self.page_size
+        try:
+            size = int(value)
+        except ValueError:
+            raise InvalidCursor('Invalid page_size parameter.')
+        if size < 1:
+            raise InvalidCursor('Invalid page_size parameter.')
+        return min(size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request):
+        """
+        Return the list of objects for the requested page.
+        """
+        page_query = self.page_query(queryset, request)
+        return self.finish_page(list(page_query))
+
+    async def apaginate_queryset(self, queryset, request):
+        page_query = self.page_query(queryset, request)
+        return self.finish_page([row async for row in page_query.aiterator()])
+
+    def page_query(self, queryset, request):
+        """
+        The slice of ``queryset`` holding the page, plus one row to tell
+        whether there is another.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        # request.GET rather than query_params so plain Django (async)
+        # requests work too; DRF's Request passes it through.
+        self.reverse, self.position = self.decode_cursor(
+            request.GET.get(self.cursor_query_param),
+            queryset.model,
+        )
+
+        self.is_first_page = self.position is None
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(_flip(field) for field in ordering)
+
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self._after(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, rows):
+        page_size, reverse, position = self.page_size, self.reverse, self.position
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_cursor = self.encode_cursor(False, rows[-1]) if rows and has_next else None
+        self.previous_cursor = self.encode_cursor(True, rows[0]) if rows and has_previous else None
+        return rows
+
+    def get_count(self, queryset, rows):
+        """
+        Total number of rows in ``queryset``. Free when the whole result
+        fits on the first page; otherwise a single COUNT query.
+        """
+        if self.is_first_page and self.next_cursor is None:
+            return len(rows)
+        return queryset.count()
+
+    async def aget_count(self, queryset, rows):
+        if self.is_first_page and self.next_cursor is None:
+            return len(rows)
+        return await queryset.acount()
+
+    def get_next_link(self):
+        return self._link(self.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.previous_cursor)
+
+    # -----------------------
+    # Cursor encoding
+    # -----------------------
+
+    def encode_cursor(self, reverse, obj):
+        values = [_dump(_position_value(obj, field.lstrip('-'))) for field in self.ordering]
+        payload = json.dumps({'r': int(reverse), 'p': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token, model):
+        if not token:
+            return False, None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                _load(model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return bool(payload['r']), position
+        except (ValueError, TypeError, KeyError, ValidationError, decimal.InvalidOperation):
+            raise InvalidCursor('Invalid cursor.')
+
+    def _after(self, ordering, position):
+        """
+        Build the keyset predicate "row comes after position" for a
+        (possibly mixed-direction) ordering.
+        """
+        condition = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            prefix = {ordering[j].lstrip('-'): position[j] for j in range(i)}
+            condition |= Q(**prefix, **{f'{name}__{lookup}': position[i]})
+        return condition
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def _position_value(obj, name):
+    if isinstance(obj, dict):
+        return obj[name]
+    return getattr(obj, name)
+
+
+def _dump(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def _load(model, name, value):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # Annotations (e.g. a search rank) are stored as plain JSON values.
+        return value
+    return field.to_python(value)
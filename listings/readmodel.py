@@ -0,0 +1,105 @@
+"""
+The published-listing read model.
+
+The public endpoints (feed, search, facets, detail, export) read
+PublishedListing instead of Listing: one row per published listing with
+its API representation rendered ahead of time, plus the columns they
+filter and sort on. A page is one range scan over an index of that
+table, and serializing it is picking the requested keys out of each
+payload (see serializers.PublishedListingSerializer).
+
+Rows are written in the same transaction as the listing itself.
+Listing.save covers single writes, including publishing and unpublishing
+through the API; every bulk path (bulk operations endpoint, photo
+variants, geocoding) calls sync_published() with the ids it touched.
+Deleting a listing deletes its row through the cascade. A write that
+bypasses all of these (a raw queryset update) must call sync_published()
+itself, and changing how listings render (MEDIA_URL, storage, serializer
+fields) needs `manage.py rebuild_published_listings`. Migration 0013
+backfills the table when it is first deployed.
+"""
+from django.apps import apps as global_apps
+from django.db import transaction
+
+# Listings loaded and upserted per query.
+BATCH_SIZE = 500
+
+# Listing columns copied as they are into PublishedListing.
+COLUMNS = (
+    'slug', 'created_at', 'price', 'location', 'latitude', 'longitude',
+    'geohash', 'bedrooms', 'bathrooms', 'category',
+)
+
+
+def published_row(model, row, serializer):
+    """
+    The PublishedListing (``model``) for a published listing, from its
+    ``values()`` ``row`` (see row_fields()). ``serializer`` is a detail
+    ListingValuesSerializer, which renders the same payload as
+    ListingSerializer without building a model instance.
+    """
+    return model(
+        id_id=row['id'],
+        **{name: row[name] for name in COLUMNS},
+        search_text=search_text(row),
+        payload=serializer.to_representation(row),
+    )
+
+
+def row_fields(serializer):
+    return tuple(dict.fromkeys(('id', *COLUMNS, 'title', 'description', *serializer.fields)))
+
+
+def search_text(row):
+    return '\n'.join([
+        row['title'], row['location'], row['description'], row['category'].replace('_', ' ')
+    ])
+
+
+def sync_published(ids, using=None, apps=global_apps):
+    """
+    Bring the rows of the listings ``ids`` up to date: upsert the ones
+    that are published, delete the rest (including ids that no longer
+    exist). Migrations pass their historical ``apps``.
+    """
+    from .serializers import ListingValuesSerializer
+
+    Listing = apps.get_model('listings', 'Listing')
+    PublishedListing = apps.get_model('listings', 'PublishedListing')
+
+    ids = list(ids)
+    update_fields = [
+        field.name for field in PublishedListing._meta.concrete_fields if not field.primary_key
+    ]
+    serializer = ListingValuesSerializer(detail=True)
+    with transaction.atomic(using=using):
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            rows = [
+                published_row(PublishedListing, row, serializer)
+                for row in Listing._default_manager.using(using).filter(pk__in=batch, is_published=True)
+                .values(*row_fields(serializer))
+            ]
+            published = {row.pk for row in rows}
+            PublishedListing._default_manager.using(using).filter(
+                pk__in=[pk for pk in batch if pk not in published]
+            ).delete()
+            if rows:
+                PublishedListing._default_manager.using(using).bulk_create(
+                    rows, update_conflicts=True, unique_fields=['id'], update_fields=update_fields
+                )
+
+
+def rebuild_published(using=None, apps=global_apps):
+    """
+    Repopulate the whole table from Listing. Returns the number of
+    published listings.
+    """
+    Listing = apps.get_model('listings', 'Listing')
+    PublishedListing = apps.get_model('listings', 'PublishedListing')
+
+    with transaction.atomic(using=using):
+        PublishedListing._default_manager.using(using).all().delete()
+        ids = list(Listing._default_manager.using(using).filter(is_published=True).values_list('pk', flat=True))
+        sync_published(ids, using=using, apps=apps)
+    return len(ids)
@@ -0,0 +1,222 @@
+"""
+Full-text search over listings.
+
+PostgreSQL keeps a weighted tsvector in a generated column with a GIN
+index; SQLite keeps an FTS5 table in sync with triggers. Either way the
+database maintains the index itself, so bulk inserts and queryset
+updates stay searchable, and a search is an index lookup instead of a
+LIKE '%x%' scan over every text column.
+
+Weights: title > location > description > category.
+
+The index covers the listings table, while the public endpoints query
+PublishedListing (see listings.readmodel), which shares its ids; the
+backends match ids against the index and rank each row of whatever
+table is being searched. The fallback backend scans the read model's
+search_text column.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+TABLE = 'listings_listing'
+FTS_TABLE = 'listings_listing_fts'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class PostgresSearchBackend:
+    config = 'english'
+
+    def install(self, cursor):
+        cursor.execute(f"""
+            ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('{self.config}', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('{self.config}', coalesce(location, '')), 'B') ||
+                setweight(to_tsvector('{self.config}', coalesce(description, '')), 'C') ||
+                setweight(to_tsvector('{self.config}', replace(coalesce(category, ''), '_', ' ')), 'D')
+            ) STORED
+        """)
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS listing_search_vector_gin ON {TABLE} USING gin (search_vector)'
+        )
+
+    def uninstall(self, cursor):
+        cursor.execute('DROP INDEX IF EXISTS listing_search_vector_gin')
+        cursor.execute(f'ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector')
+
+    def ensure(self, cursor):
+        # The generated column survives schema changes on PostgreSQL.
+        pass
+
+    def search(self, queryset, query):
+        tsquery = f"websearch_to_tsquery('{self.config}', %s)"
+        table = queryset.model._meta.db_table
+        if table == TABLE:
+            return queryset.filter(
+                RawSQL(f'{TABLE}.search_vector @@ {tsquery}', [query], output_field=BooleanField())
+            ).annotate(
+                search_rank=RawSQL(
+                    f'ts_rank_cd({TABLE}.search_vector, {tsquery})', [query], output_field=FloatField()
+                )
+            )
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT id FROM {TABLE} WHERE search_vector @@ {tsquery}', [query])
+        ).annotate(
+            search_rank=RawSQL(
+                f'(SELECT ts_rank_cd(l.search_vector, {tsquery}) FROM {TABLE} l WHERE l.id = {table}.id)',
+                [query],
+                output_field=FloatField(),
+            )
+        )
+
+
+class SQLiteSearchBackend:
+    # bm25() weights, in FTS column order: title, location, description, category.
+    weights = (10.0, 5.0, 2.0, 1.0)
+
+    triggers = {
+        'listings_listing_fts_ai': f"""
+            CREATE TRIGGER IF NOT EXISTS listings_listing_fts_ai AFTER INSERT ON {TABLE} BEGIN
+                INSERT INTO {FTS_TABLE} (rowid, title, location, description, category)
+                VALUES (new.id, new.title, new.location, new.description, replace(new.category, '_', ' '));
+            END
+        """,
+        'listings_listing_fts_ad': f"""
+            CREATE TRIGGER IF NOT EXISTS listings_listing_fts_ad AFTER DELETE ON {TABLE} BEGIN
+                DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+            END
+        """,
+        'listings_listing_fts_au': f"""
+            CREATE TRIGGER IF NOT EXISTS listings_listing_fts_au
+            AFTER UPDATE OF title, location, description, category ON {TABLE} BEGIN
+                DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+                INSERT INTO {FTS_TABLE} (rowid, title, location, description, category)
+                VALUES (new.id, new.title, new.location, new.description, replace(new.category, '_', ' '));
+            END
+        """,
+    }
+
+    def install(self, cursor):
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                title, location, description, category,
+                tokenize = 'porter unicode61'
+            )
+        """)
+        for sql in self.triggers.values():
+            cursor.execute(sql)
+        self.rebuild(cursor)
+
+    def uninstall(self, cursor):
+        for name in self.triggers:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def ensure(self, cursor):
+        """
+        SQLite drops a table's triggers whenever Django rebuilds the table
+        during a migration, so reinstall them (and resync) if any are gone.
+        """
+        if FTS_TABLE not in cursor.db.introspection.table_names(cursor):
+            return
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [TABLE]
+        )
+        present = {row[0] for row in cursor.fetchall()}
+        if not set(self.triggers) <= present:
+            self.install(cursor)
+
+    def rebuild(self, cursor):
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f"""
+            INSERT INTO {FTS_TABLE} (rowid, title, location, description, category)
+            SELECT id, title, location, description, replace(category, '_', ' ') FROM {TABLE}
+        """)
+
+    def match_expression(self, query):
+        """
+        Turn free text into an FTS5 query: every word must match, and the
+        last one may be a prefix so partially typed searches still hit.
+        """
+        tokens = _TOKEN_RE.findall(query)
+        if not tokens:
+            return None
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if match is None:
+            return queryset.none()
+        weights = ', '.join(str(w) for w in self.weights)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        ).annotate(
+            # bm25() is lower-is-better; negate it so rank sorts descending
+            # like PostgreSQL's ts_rank_cd.
+            search_rank=RawSQL(
+                f'(SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id)',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+
+class FallbackSearchBackend:
+    """
+    Unindexed substring search for databases without a full-text engine.
+    """
+
+    def install(self, cursor):
+        pass
+
+    def uninstall(self, cursor):
+        pass
+
+    def ensure(self, cursor):
+        pass
+
+    def search(self, queryset, query):
+        if hasattr(queryset.model, 'search_text'):
+            condition = Q(search_text__icontains=query)
+        else:
+            condition = (
+                Q(title__icontains=query) |
+                Q(description__icontains=query) |
+                Q(location__icontains=query) |
+                Q(category__icontains=query)
+            )
+        return queryset.filter(condition).annotate(
+            search_rank=RawSQL('0.0', [], output_field=FloatField())
+        )
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend(connection):
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+def search_listings(queryset, query):
+    """
+    Restrict a Listing or PublishedListing queryset to rows matching
+    ``query``, annotated with a ``search_rank`` (higher is more relevant).
+    """
+    return get_backend(connections[queryset.db]).search(queryset, query)
+
+
+def ensure_search_index(using='default', **kwargs):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        get_backend(connection).ensure(cursor)
@@ -1,15 +1,264 @@
-from rest_framework import serializers
+import decimal
+
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .images import PHOTO_FIELDS, srcset
 from .models import Listing
+from .uploads import process_photo
+
+
+class PhotoVariantsField(serializers.Field):
+    """
+    Renders Listing.photo_variants as srcset strings:
+    {'main_photo': {'webp': '<url> 320w, <url> 640w', 'jpeg': '...'}}.
+    Photos whose variants haven't been built yet are left out.
+    """
+
+    def __init__(self, photo_fields=PHOTO_FIELDS, **kwargs):
+        kwargs['read_only'] = True
+        self.photo_fields = photo_fields
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = Listing._meta.get_field('main_photo').storage
+        return {
+            field: {
+                ext: srcset(storage, widths)
+                for ext, widths in value[field].items() if ext != 'source'
+            }
+            for field in self.photo_fields if field in (value or {})
+        }
+
+
+class ListingPhotoField(serializers.ImageField):
+    """
+    ImageField that validates the upload from its header instead of
+    decoding it, and stores the capped, EXIF-free re-encoding made by
+    listings.uploads.process_photo().
+    """
+
+    def to_internal_value(self, data):
+        upload = serializers.FileField.to_internal_value(self, data)
+        try:
+            return process_photo(upload)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
 
 class ListingSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: ListingPhotoField,
+    }
     category = serializers.ChoiceField(choices=Listing.CategoryChoices.choices)
+    photo_variants = PhotoVariantsField()
     
     class Meta:
         model = Listing
         fields = '__all__'
         read_only_fields = ['realtor','slug']
 
+    def validate(self, attrs):
+        latitude = attrs.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = attrs.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError('latitude and longitude must be set together.')
+        return attrs
+
     def create(self, validated_data):
         validated_data['realtor'] = self.context['request'].user
         validated_data['realtor_email'] = self.context['request'].user.email
         return super().create(validated_data)
+
+
+class ListingListSerializer(ListingSerializer):
+    """
+    Compact representation for listing collections.
+
+    Renders ``default_fields`` unless a ``fields`` subset is given (any
+    field of ListingSerializer may be requested); the full representation
+    stays on the detail endpoint.
+    """
+    default_fields = (
+        'id', 'title', 'slug', 'price', 'location', 'bedrooms',
+        'bathrooms', 'category', 'created_at', 'main_photo', 'photo_variants',
+    )
+    # Collections only need the srcset of the cover photo.
+    photo_variants = PhotoVariantsField(photo_fields=('main_photo',))
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = set(fields or self.default_fields)
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, value):
+        """
+        Parse a ``?fields=a,b`` value into a tuple of field names, or
+        None when absent. Raises ValueError on unknown fields.
+        """
+        if not value:
+            return None
+        fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = set(fields) - set(cls.all_fields())
+        if unknown or not fields:
+            raise ValueError('Invalid fields parameter.')
+        return fields
+
+    @classmethod
+    def all_fields(cls):
+        return [field.name for field in Listing._meta.concrete_fields]
+
+    @classmethod
+    def model_fields(cls, fields=None):
+        """
+        Columns to load with ``.only()`` to render ``fields``, including
+        the keys the cursor paginator reads.
+        """
+        return tuple(dict.fromkeys((*(fields or cls.default_fields), 'id', 'created_at')))
+
+
+class ListingValuesSerializer:
+    """
+    Read-only fast path that renders ``values()`` rows exactly like
+    ListingListSerializer (or, with ``detail``, ListingSerializer) renders
+    model instances: same keys, same order, same formatting, so the JSON
+    output is byte-identical.
+
+    No model instances or FieldFiles are built and DRF's per-field
+    get_attribute/to_representation chain is skipped: each column gets a
+    precomputed converter (decimal quantum, output timezone, media URL
+    prefix) chosen once per serializer.
+    """
+
+    def __init__(self, fields=None, detail=False):
+        drf_fields = ListingSerializer().fields if detail else ListingListSerializer(fields=fields).fields
+        self.fields = tuple(drf_fields)
+        self._converters = tuple(
+            (name, self._converter(Listing._meta.get_field(name), drf_fields[name]))
+            for name in self.fields
+        )
+
+    def to_representation(self, row):
+        return {
+            name: convert(row[name]) if convert else row[name]
+            for name, convert in self._converters
+        }
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+    def serialize_tuples(self, rows):
+        """
+        Render rows from ``values_list(*self.fields)``.
+        """
+        converters = [convert for _, convert in self._converters]
+        for row in rows:
+            yield {
+                name: convert(value) if convert else value
+                for name, convert, value in zip(self.fields, converters, row)
+            }
+
+    # -----------------------
+    # Converters
+    # -----------------------
+
+    def _converter(self, model_field, drf_field):
+        if isinstance(drf_field, serializers.DecimalField):
+            return self._decimal_converter(drf_field)
+        if isinstance(drf_field, serializers.DateTimeField):
+            return self._datetime_converter(drf_field)
+        if isinstance(drf_field, serializers.FileField):
+            return self._file_converter(model_field, drf_field)
+        if isinstance(drf_field, (serializers.IntegerField, serializers.FloatField, serializers.BooleanField,
+                                  serializers.CharField, serializers.PrimaryKeyRelatedField)):
+            # values() already returns the rendered type (str/int/float/bool/pk).
+            return None
+        if isinstance(drf_field, serializers.ChoiceField):
+            choices = drf_field.choice_strings_to_values
+            return lambda value: choices.get(str(value), value)
+        return drf_field.to_representation
+
+    def _decimal_converter(self, drf_field):
+        coerce_to_string = getattr(drf_field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if (not coerce_to_string or drf_field.localize or drf_field.normalize_output
+                or drf_field.decimal_places is None):
+            return drf_field.to_representation
+        quantum = decimal.Decimal('.1') ** drf_field.decimal_places
+        context = decimal.getcontext().copy()
+        if drf_field.max_digits is not None:
+            context.prec = drf_field.max_digits
+        rounding = drf_field.rounding
+
+        def convert(value):
+            if value is None:
+                return ''
+            return f'{value.quantize(quantum, rounding=rounding, context=context):f}'
+        return convert
+
+    def _datetime_converter(self, drf_field):
+        output_format = getattr(drf_field, 'format', api_settings.DATETIME_FORMAT)
+        tz = drf_field.timezone if hasattr(drf_field, 'timezone') else drf_field.default_timezone()
+        if output_format is None or output_format.lower() != ISO_8601 or tz is None:
+            return drf_field.to_representation
+
+        def convert(value):
+            if not value:
+                return None
+            if timezone.is_naive(value):
+                return drf_field.to_representation(value)
+            value = value.astimezone(tz).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+
+    def _file_converter(self, model_field, drf_field):
+        use_url = getattr(drf_field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        storage = model_field.storage
+        if not use_url:
+            return lambda name: name or None
+        if not isinstance(storage, FileSystemStorage):
+            return lambda name: storage.url(name) if name else None
+        # FileSystemStorage.url() is urljoin(base_url, filepath_to_uri(name)),
+        # which is plain concatenation for storage-generated names.
+        prefix = storage.base_url
+
+        def convert(name):
+            if not name:
+                return None
+            return prefix + filepath_to_uri(name).lstrip('/')
+        return convert
+
+
+class PublishedListingSerializer:
+    """
+    Renders PublishedListing payloads like ListingListSerializer (or,
+    with ``detail``, ListingSerializer) renders the listing: the payload
+    already is the full representation, so this only picks the requested
+    keys in order and trims photo_variants to the photos shown.
+    """
+
+    def __init__(self, fields=None, detail=False):
+        drf_fields = ListingSerializer().fields if detail else ListingListSerializer(fields=fields).fields
+        self.fields = tuple(drf_fields)
+        self.photo_fields = drf_fields['photo_variants'].photo_fields if 'photo_variants' in drf_fields else ()
+
+    def to_representation(self, payload):
+        data = {name: payload[name] for name in self.fields}
+        if 'photo_variants' in data:
+            variants = data['photo_variants']
+            data['photo_variants'] = {field: variants[field] for field in self.photo_fields if field in variants}
+        return data
+
+    def serialize(self, rows):
+        """
+        Render rows from ``values('payload', ...)``.
+        """
+        return [self.to_representation(row['payload']) for row in rows]
@@ -0,0 +1,69 @@
+import re
+from collections import defaultdict
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.text import slugify
+
+
+def base_slug(title):
+    return slugify(title) or 'listing'
+
+
+def allocate_slugs(model, titles, using=None):
+    """
+    Return a unique slug for each title, in order.
+
+    Existing "<base>" / "<base>-<n>" slugs for every base in the batch are
+    read with one query, as a prefix match on the unique slug index, so the
+    cost doesn't grow with how many times a title has been used. Callers
+    still have to handle the IntegrityError raised if a concurrent insert
+    takes the same slug first.
+    """
+    if not titles:
+        return []
+    bases = [base_slug(title) for title in titles]
+    queryset = model._default_manager.using(using)
+    vendor = connections[queryset.db].vendor
+    condition = Q()
+    for base in set(bases):
+        condition |= Q(slug=base) | prefix_condition(base, vendor)
+
+    used = set(queryset.filter(condition).values_list('slug', flat=True))
+    taken = defaultdict(lambda: -1)
+    patterns = {base: re.compile(rf'^{re.escape(base)}(?:-(\d+))?$') for base in set(bases)}
+    for slug in used:
+        for base, pattern in patterns.items():
+            match = pattern.match(slug)
+            if match:
+                taken[base] = max(taken[base], int(match.group(1) or 0))
+
+    slugs = []
+    for base in bases:
+        # Skip over slugs taken earlier in this batch by a different base
+        # (e.g. "Flat 2" and the third "Flat" both want "flat-2").
+        while True:
+            taken[base] += 1
+            slug = base if taken[base] == 0 else f'{base}-{taken[base]}'
+            if slug not in used:
+                break
+        used.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def prefix_condition(base, vendor):
+    """
+    Match slugs starting with "<base>-".
+
+    On PostgreSQL the LIKE is served by the varchar_pattern_ops index
+    Django adds next to the unique slug index. SQLite's LIKE is case
+    insensitive and can't use the index, so there it also gets a range
+    bound: SQLite compares text bytewise, so every "<base>-..." sorts
+    between "<base>-" and "<base>.". The range alone would be wrong under
+    a linguistic collation, which ignores the punctuation.
+    """
+    condition = Q(slug__startswith=f'{base}-')
+    if vendor == 'sqlite':
+        condition &= Q(slug__gt=f'{base}-', slug__lt=f'{base}.')
+    return condition
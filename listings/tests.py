@@ -1,3 +1,1386 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Q
+from asgiref.sync import sync_to_async
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils.text import slugify
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from realestate.queries import QueryBudgetExceeded, inspect_queries, sql_shape
+from users.models import UserAccount
+from .cache import get_cache, invalidate_listings
+from .cleanup import delete_pending, get_storage, queue_file_deletion
+from .geo import encode_geohash, geohash_condition, next_prefix
+from .images import build_variants, render_variants
+from .models import Listing, PendingFileDeletion, PublishedListing
+from .search import search_listings
+from .serializers import (
+    ListingListSerializer, ListingSerializer, ListingValuesSerializer, PublishedListingSerializer,
+)
+from .slugs import allocate_slugs
+from .urls import async_read_patterns, read_patterns
+from .views import ListingsExportView
+from rest_framework_simplejwt.tokens import AccessToken
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'listings': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'listings'},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'users'},
+}
+
+# URLconf for AsyncListingViewTests: the async views where ASGI=True would
+# put them, and the sync ones next to them to compare against.
+urlpatterns = [
+    path('api/listings/', include(async_read_patterns)),
+    path('sync/api/listings/', include(read_patterns)),
+]
+
+# Fail any request that runs a query shape more than
+# QUERY_INSPECTOR_REPEAT_THRESHOLD times (N+1) or blows the query budget.
+QUERY_CHECKS = {'QUERY_INSPECTOR_ENABLED': True, 'QUERY_INSPECTOR_RAISE': True}
+
+
+def setUpModule():
+    # Most listings here point at photos that aren't in storage; the
+    # variant tests turn builds back on where they need them.
+    variants_off = override_settings(LISTING_IMAGE_VARIANTS='off')
+    variants_off.enable()
+    unittest.addModuleCleanup(variants_off.disable)
+
+
+def make_listing(realtor, **kwargs):
+    fields = {
+        'title': 'Listing',
+        'description': 'A listing',
+        'price': 100,
+        'location': 'Lagos',
+        'main_photo': 'listings/photo.jpg',
+        'is_published': True,
+    }
+    fields.update(kwargs)
+    return Listing.objects.create(realtor=realtor, realtor_email=realtor.email, **fields)
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class ListingQueryPlanTests(TestCase):
+    """
+    Run the main endpoints, then EXPLAIN every listing query they issued
+    so a change to a query or to the Listing/PublishedListing indexes
+    can't silently turn an index lookup into a table scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        for i in range(30):
+            make_listing(
+                cls.realtor,
+                title=f'Listing {i}',
+                price=1000 + i,
+                category='FOR_RENT' if i % 2 else 'FOR_SALE',
+                is_published=i % 3 != 0,
+                latitude=6.4 + i * 0.01,
+                longitude=3.4,
+            )
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+
+    def plan(self, sql):
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def listing_plans(self, url, table='listings_publishedlisting'):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            self.plan(query['sql'])
+            for query in ctx.captured_queries
+            if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']
+        ]
+
+    def assertNoTableScan(self, plans, table='listings_publishedlisting'):
+        self.assertTrue(plans)
+        for plan in plans:
+            for line in plan.splitlines():
+                self.assertNotRegex(line, rf'^SCAN {table}$|Seq Scan on {table}\b')
+
+    def test_feed_uses_published_created_index(self):
+        plans = self.listing_plans('/api/listings/get-listings?page_size=5')
+        self.assertNoTableScan(plans)
+        self.assertIn('published_created_idx', plans[-1])
+
+    def test_feed_next_page_uses_published_created_index(self):
+        first = self.client.get('/api/listings/get-listings?page_size=5').json()
+        plans = self.listing_plans(first['next'])
+        self.assertNoTableScan(plans)
+        self.assertIn('published_created_idx', plans[-1])
+
+    def test_detail_uses_slug_index(self):
+        self.client.force_authenticate(self.realtor)
+        slug = Listing.objects.filter(is_published=True).values_list('slug', flat=True).first()
+        plans = self.listing_plans(f'/api/listings/detail?slug={slug}')
+        self.assertNoTableScan(plans)
+
+    def test_search_by_category_and_price_uses_index(self):
+        plans = self.listing_plans('/api/listings/search?category=FOR_RENT&max_price=1020')
+        self.assertNoTableScan(plans)
+        for plan in plans:
+            self.assertIn('published_category_price_idx', plan)
+
+    def test_search_by_price_uses_index(self):
+        plans = self.listing_plans('/api/listings/search?max_price=1010')
+        self.assertNoTableScan(plans)
+
+    def test_radius_search_uses_geohash_index(self):
+        plans = self.listing_plans('/api/listings/search?lat=6.45&lng=3.4&radius_km=5')
+        self.assertNoTableScan(plans)
+        self.assertIn('published_geohash_idx', plans[-1])
+
+    def test_realtor_dashboard_uses_realtor_created_index(self):
+        self.client.force_authenticate(self.realtor)
+        plans = self.listing_plans('/api/listings/manage', table='listings_listing')
+        self.assertNoTableScan(plans, table='listings_listing')
+        self.assertIn('listing_realtor_created_idx', plans[-1])
+
+    def test_slug_allocation_uses_slug_index(self):
+        with CaptureQueriesContext(connection) as ctx:
+            allocate_slugs(Listing, ['Listing 1', 'Flat'])
+        plans = [self.plan(query['sql']) for query in ctx.captured_queries]
+        self.assertNoTableScan(plans, table='listings_listing')
+
+    def test_realtor_slug_lookup_uses_index(self):
+        self.client.force_authenticate(self.realtor)
+        slug = Listing.objects.filter(realtor=self.realtor).values_list('slug', flat=True).first()
+        plans = self.listing_plans(f'/api/listings/manage?slug={slug}', table='listings_listing')
+        self.assertNoTableScan(plans, table='listings_listing')
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class ListingQueryCountTests(TestCase):
+    """
+    Each public endpoint fetches its rows in one query, plus at most one
+    COUNT for search results that span several pages.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        cls.user = UserAccount.objects.create_user('user@example.com', 'User', password='password123')
+        for i in range(25):
+            make_listing(cls.realtor, title=f'Flat {i}', price=1000 + i)
+        make_listing(cls.realtor, title='Draft', is_published=False)
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+
+    def test_feed_first_page(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/listings/get-listings')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['listings']), 20)
+
+    def test_feed_next_page(self):
+        next_url = self.client.get('/api/listings/get-listings').json()['next']
+        with self.assertNumQueries(1):
+            response = self.client.get(next_url)
+        self.assertEqual(len(response.json()['listings']), 5)
+
+    def test_feed_empty(self):
+        for listing in Listing.objects.all():
+            listing.is_published = False
+            listing.save()
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/listings/get-listings')
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail(self):
+        self.client.force_authenticate(self.user)
+        slug = Listing.objects.filter(is_published=True).values_list('slug', flat=True).first()
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/listings/detail?slug={slug}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_missing(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/listings/detail?slug=draft')
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_single_page_skips_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/listings/search?max_price=1004')
+        self.assertEqual(response.json()['count'], 5)
+
+    def test_search_multiple_pages(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/listings/search?search=flat')
+        self.assertEqual(response.json()['count'], 25)
+
+    def test_search_no_results(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/listings/search?search=castle')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS, LISTING_FILE_CLEANUP_ON_COMMIT=False)
+class ListingCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        cls.listing = make_listing(cls.realtor, title='Cached flat')
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.realtor)
+
+    def test_feed_is_served_from_cache(self):
+        self.assertEqual(self.client.get('/api/listings/get-listings')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/listings/get-listings')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['listings'][0]['title'], 'Cached flat')
+
+    def test_save_invalidates_feed_and_detail(self):
+        detail_url = f'/api/listings/detail?slug={self.listing.slug}'
+        self.client.get('/api/listings/get-listings')
+        self.client.get(detail_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.title = 'Renamed flat'
+            self.listing.save()
+
+        response = self.client.get('/api/listings/get-listings')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['listings'][0]['title'], 'Renamed flat')
+        response = self.client.get(detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['listing']['title'], 'Renamed flat')
+
+    def test_delete_invalidates_search(self):
+        self.assertEqual(self.client.get('/api/listings/search?search=flat').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.delete()
+        self.assertEqual(self.client.get('/api/listings/search?search=flat').status_code, 404)
+
+    @override_settings(LISTING_FILE_CLEANUP_ON_COMMIT=False)
+    def test_deleting_realtor_account_expires_listings_and_queues_files(self):
+        other = make_listing(self.realtor, title='Other flat', main_photo='listings/other.jpg')
+        self.assertEqual(self.client.get('/api/listings/get-listings').status_code, 200)
+
+        with mock.patch('listings.cache.invalidate_listings', wraps=invalidate_listings) as invalidate, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/users/me/', {'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, 204)
+
+        # One bump for both listings.
+        invalidate.assert_called_once()
+        self.assertEqual(sorted(invalidate.call_args.args[0]), sorted([self.listing.slug, other.slug]))
+        self.assertEqual(
+            sorted(PendingFileDeletion.objects.values_list('name', flat=True)),
+            ['listings/other.jpg', 'listings/photo.jpg'],
+        )
+        response = self.client.get('/api/listings/get-listings')
+        self.assertEqual((response.status_code, response['X-Cache']), (404, 'MISS'))
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class ListingConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        cls.listing = make_listing(cls.realtor, title='Polled flat')
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.realtor)
+
+    def test_if_none_match_returns_304_without_queries(self):
+        etag = self.client.get('/api/listings/get-listings')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/listings/get-listings', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_returns_304(self):
+        url = f'/api/listings/detail?slug={self.listing.slug}'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_save_in_the_same_second_still_modifies(self):
+        url = f'/api/listings/detail?slug={self.listing.slug}'
+        with mock.patch('listings.cache.time.time', return_value=1_800_000_000.5):
+            last_modified = self.client.get(url)['Last-Modified']
+            with self.captureOnCommitCallbacks(execute=True):
+                self.listing.save()
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+    def test_etag_changes_when_listing_is_saved(self):
+        url = f'/api/listings/detail?slug={self.listing.slug}'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ListingValuesSerializerTests(TestCase):
+    """
+    The values() fast path must render byte-identical JSON to DRF.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        make_listing(cls.realtor, title='Plain', price=100)
+        make_listing(
+            cls.realtor,
+            title='Everything set',
+            description='Line one\nLine "two" – ünïcode',
+            price='1234567.5',
+            bathrooms='2.5',
+            bedrooms=4,
+            category='FOR_RENT',
+            main_photo='listings/main photo ü.jpg',
+            photo_1='listings/one.jpg',
+            photo_2='',
+            is_published=False,
+            photo_variants={
+                'main_photo': {
+                    'source': 'listings/main photo ü.jpg',
+                    'webp': {'640': 'listings/derived/main photo ü-640w.webp',
+                             '320': 'listings/derived/main photo ü-320w.webp'},
+                    'jpeg': {'320': 'listings/derived/main photo ü-320w.jpeg'},
+                },
+            },
+        )
+
+    def assertSameJSON(self, fields):
+        queryset = Listing.objects.order_by('id')
+        expected = ListingListSerializer(queryset, many=True, fields=fields).data
+        rows = queryset.values(*ListingListSerializer.model_fields(fields))
+        actual = ListingValuesSerializer(fields).serialize(rows)
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_default_fields(self):
+        self.assertSameJSON(None)
+
+    def test_all_fields(self):
+        self.assertSameJSON(tuple(ListingListSerializer.all_fields()))
+
+    def test_detail(self):
+        queryset = Listing.objects.order_by('id')
+        expected = ListingSerializer(queryset, many=True).data
+        serializer = ListingValuesSerializer(detail=True)
+        actual = serializer.serialize(queryset.values(*serializer.fields))
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_tuples(self):
+        fields = tuple(ListingListSerializer.all_fields())
+        serializer = ListingValuesSerializer(fields)
+        queryset = Listing.objects.order_by('id')
+        expected = ListingListSerializer(queryset, many=True, fields=fields).data
+        actual = list(serializer.serialize_tuples(queryset.values_list(*serializer.fields)))
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class PublishedListingTests(TestCase):
+    """
+    The read model follows every write path and renders exactly what the
+    serializers would render from the listing.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        cls.listing = make_listing(
+            cls.realtor,
+            title='Garden duplex',
+            description='Line one\nLine "two" – ünïcode',
+            price='1234567.5',
+            bathrooms='2.5',
+            category='FOR_RENT',
+            main_photo='listings/main.jpg',
+            photo_1='listings/one.jpg',
+            photo_variants={
+                'main_photo': {'source': 'listings/main.jpg', 'webp': {'320': 'listings/derived/main-320w.webp'}},
+                'photo_1': {'source': 'listings/one.jpg', 'webp': {'320': 'listings/derived/one-320w.webp'}},
+            },
+        )
+        cls.draft = make_listing(cls.realtor, title='Draft', is_published=False)
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.realtor)
+
+    def test_only_published_listings_have_rows(self):
+        self.assertEqual(list(PublishedListing.objects.values_list('pk', flat=True)), [self.listing.pk])
+
+    def test_payloads_match_serializers(self):
+        fields = tuple(ListingListSerializer.all_fields())
+        for serializer_fields in (None, fields):
+            expected = ListingListSerializer([self.listing], many=True, fields=serializer_fields).data
+            rows = PublishedListing.objects.values('payload')
+            actual = PublishedListingSerializer(serializer_fields).serialize(rows)
+            self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+        response = self.client.get(f'/api/listings/detail?slug={self.listing.slug}')
+        self.assertEqual(response.json()['listing'], json.loads(
+            JSONRenderer().render(ListingSerializer(Listing.objects.get(pk=self.listing.pk)).data)
+        ))
+
+    def test_publish_and_unpublish(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/listings/manage', {'slug': self.draft.slug, 'is_published': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(PublishedListing.objects.filter(pk=self.draft.pk).exists())
+        self.assertEqual(self.client.get(f'/api/listings/detail?slug={self.draft.slug}').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/listings/manage', {'slug': self.draft.slug, 'is_published': False})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(PublishedListing.objects.filter(pk=self.draft.pk).exists())
+        self.assertEqual(self.client.get(f'/api/listings/detail?slug={self.draft.slug}').status_code, 404)
+
+    def test_save_rerenders_row(self):
+        self.listing.title = 'Garden maisonette'
+        self.listing.price = 99
+        self.listing.save()
+        row = PublishedListing.objects.get(pk=self.listing.pk)
+        self.assertEqual(row.payload['title'], 'Garden maisonette')
+        self.assertEqual(row.payload['price'], '99.00')
+        self.assertEqual(row.price, 99)
+        self.assertIn('Garden maisonette', row.search_text)
+        results = self.client.get('/api/listings/search?search=maisonette').json()['results']
+        self.assertEqual([result['slug'] for result in results], [self.listing.slug])
+
+    def test_delete_removes_row(self):
+        self.listing.delete()
+        self.assertFalse(PublishedListing.objects.exists())
+
+    def test_bulk_operations(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        photo = BytesIO()
+        Image.new('RGB', (8, 8)).save(photo, 'PNG')
+        operations = [
+            {'op': 'create', 'data': {
+                'title': 'Bulk flat', 'description': 'A flat', 'price': 500, 'location': 'Lagos',
+                'category': 'FOR_SALE', 'is_published': True,
+            }},
+            {'op': 'update', 'slug': self.draft.slug, 'data': {'is_published': True}},
+            {'op': 'delete', 'slug': self.listing.slug},
+        ]
+        with override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post('/api/listings/manage/bulk', {
+                'operations': json.dumps(operations),
+                '0.main_photo': SimpleUploadedFile('bulk.png', photo.getvalue(), content_type='image/png'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            sorted(PublishedListing.objects.values_list('slug', flat=True)),
+            sorted([self.draft.slug, response.json()['results'][0]['slug']]),
+        )
+
+    def test_rebuild(self):
+        PublishedListing.objects.all().delete()
+        Listing.objects.filter(pk=self.draft.pk).update(is_published=True)
+        call_command('rebuild_published_listings', stdout=StringIO())
+        self.assertEqual(PublishedListing.objects.count(), 2)
+
+
+class PublishedListingMigrationTests(TransactionTestCase):
+    before = [('listings', '0012_published_listing')]
+    after = [('listings', '0013_backfill_published_listing')]
+
+    def setUp(self):
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(self.after))
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def test_migrate_backfills_published_listings(self):
+        realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        HistoricalListing = self.apps.get_model('listings', 'Listing')
+        listings = [
+            HistoricalListing.objects.create(
+                realtor_id=realtor.pk, realtor_email=realtor.email, title=title, slug=slugify(title),
+                description='A listing', price=100, location='Lagos', main_photo='listings/photo.jpg',
+                is_published=is_published,
+            )
+            for title, is_published in (('Published flat', True), ('Draft flat', False))
+        ]
+
+        MigrationExecutor(connection).migrate(self.after)
+
+        self.assertEqual(list(PublishedListing.objects.values_list('pk', flat=True)), [listings[0].pk])
+        expected = ListingSerializer(Listing.objects.get(pk=listings[0].pk)).data
+        self.assertEqual(
+            JSONRenderer().render(PublishedListing.objects.get().payload), JSONRenderer().render(expected)
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class ListingSlugTests(TransactionTestCase):
+
+    def setUp(self):
+        self.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+
+    def test_next_free_suffix(self):
+        make_listing(self.realtor, title='3 Bedroom Flat')
+        make_listing(self.realtor, title='3 Bedroom Flat', slug='3-bedroom-flat-7')
+        make_listing(self.realtor, title='3 Bedroom Flatmate')
+        listing = make_listing(self.realtor, title='3 bedroom flat')
+        self.assertEqual(listing.slug, '3-bedroom-flat-8')
+
+    def test_lost_race_allocates_again(self):
+        make_listing(self.realtor, title='Duplex')
+        # Hand out a slug that is already taken, as if another request had
+        # inserted it between our lookup and our insert.
+        with mock.patch('listings.models.allocate_slugs', side_effect=[['duplex'], ['duplex-1']]):
+            listing = make_listing(self.realtor, title='Duplex')
+        self.assertEqual(listing.slug, 'duplex-1')
+
+    def test_prefix_match_does_not_rely_on_bytewise_ordering(self):
+        for title, slug in (('Flat', 'flat'), ('Flat', 'flat-3'), ('Flat B', 'flat-b'), ('Flat', 'flat2-5')):
+            make_listing(self.realtor, title=title, slug=slug)
+        # The plain prefix match used off SQLite, without the range bound
+        # that only holds for bytewise comparison.
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            slugs = allocate_slugs(Listing, ['Flat', 'Flat', 'Flat b'])
+        self.assertEqual(slugs, ['flat-4', 'flat-5', 'flat-b-1'])
+
+    def test_concurrent_saves_get_unique_slugs(self):
+        workers = 8
+        barrier = threading.Barrier(workers)
+
+        def create(_):
+            barrier.wait()
+            try:
+                return make_listing(self.realtor, title='Studio Apartment').slug
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            slugs = list(executor.map(create, range(workers)))
+
+        self.assertEqual(len(set(slugs)), workers)
+        self.assertEqual(
+            sorted(Listing.objects.values_list('slug', flat=True)),
+            sorted(['studio-apartment'] + [f'studio-apartment-{i}' for i in range(1, workers)]),
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS, LISTING_FILE_CLEANUP_ON_COMMIT=False)
+class ListingFileCleanupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = get_storage()
+
+    def store(self, name):
+        return self.storage.save(name, ContentFile(b'jpeg'))
+
+    def test_delete_leaves_files_until_the_queue_runs(self):
+        photo, variant = self.store('listings/flat.jpg'), self.store('listings/derived/flat-320w.webp')
+        listing = make_listing(self.realtor, main_photo=photo, photo_variants={
+            'main_photo': {'source': photo, 'webp': {'320': variant}, 'jpeg': {}},
+        })
+        listing.delete()
+        self.assertTrue(self.storage.exists(photo))
+        self.assertEqual(PendingFileDeletion.objects.count(), 2)
+
+        self.assertEqual(delete_pending(), 2)
+        self.assertFalse(self.storage.exists(photo))
+        self.assertFalse(self.storage.exists(variant))
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_rolled_back_delete_keeps_files(self):
+        listing = make_listing(self.realtor, main_photo=self.store('listings/flat.jpg'))
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            listing.delete()
+            raise RuntimeError
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        self.assertEqual(delete_pending(), 0)
+        self.assertTrue(self.storage.exists(listing.main_photo.name))
+
+    def test_queued_file_in_use_again_is_kept(self):
+        listing = make_listing(self.realtor, main_photo=self.store('listings/flat.jpg'))
+        queue_file_deletion([listing.main_photo.name])
+        delete_pending()
+        self.assertTrue(self.storage.exists(listing.main_photo.name))
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_queued_variant_in_use_is_kept(self):
+        photo = self.store('listings/flat ü.jpg')
+        variant, orphan = self.store('listings/derived/flat ü.jpg-320w.webp'), self.store('listings/derived/old.webp')
+        make_listing(self.realtor, main_photo=photo, photo_variants={
+            'main_photo': {'source': photo, 'webp': {'320': variant}, 'jpeg': {}},
+        })
+        queue_file_deletion([variant, orphan])
+        self.assertEqual(delete_pending(), 2)
+        self.assertTrue(self.storage.exists(variant))
+        self.assertFalse(self.storage.exists(orphan))
+
+    def test_sweep_queues_unreferenced_files(self):
+        kept = make_listing(self.realtor, main_photo=self.store('listings/kept.jpg')).main_photo.name
+        orphan = self.store('listings/derived/orphan-320w.webp')
+        call_command('sweep_media', min_age=0, stdout=StringIO())
+        self.assertEqual(list(PendingFileDeletion.objects.values_list('name', flat=True)), [orphan])
+        delete_pending()
+        self.assertTrue(self.storage.exists(kept))
+        self.assertFalse(self.storage.exists(orphan))
+
+
+@override_settings(
+    CACHES=TEST_CACHES, **QUERY_CHECKS, LISTING_FILE_CLEANUP_ON_COMMIT=False, LISTING_IMAGE_WIDTHS=(32, 64, 128),
+)
+class ListingImageVariantTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = get_storage()
+
+    def store(self, name, size=(100, 50), color='red', image_format='JPEG'):
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, image_format)
+        return self.storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_renders_widths_up_to_the_original(self):
+        listing = make_listing(self.realtor, main_photo=self.store('listings/flat.jpg'))
+        variants = render_variants(listing.main_photo)
+        self.assertEqual(set(variants), {'webp', 'jpeg'})
+        for ext, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            self.assertEqual(set(variants[ext]), {'32', '64'})
+            for width, name in variants[ext].items():
+                with self.storage.open(name, 'rb') as stored, Image.open(stored) as image:
+                    self.assertEqual(image.format, pil_format)
+                    self.assertEqual(image.width, int(width))
+
+    def test_small_photo_gets_one_variant(self):
+        listing = make_listing(self.realtor, main_photo=self.store('listings/flat.jpg', size=(20, 10)))
+        self.assertEqual(set(render_variants(listing.main_photo)['webp']), {'20'})
+
+    def test_variant_names_depend_on_source_name_and_content(self):
+        jpeg = make_listing(self.realtor, main_photo=self.store('listings/flat.jpg'))
+        png = make_listing(self.realtor, main_photo=self.store('listings/flat.png', image_format='PNG'))
+        jpeg_names = render_variants(jpeg.main_photo)['webp']
+        self.assertTrue(set(jpeg_names.values()).isdisjoint(render_variants(png.main_photo)['webp'].values()))
+
+        # A different photo stored under the freed name gets new variants.
+        self.storage.delete(jpeg.main_photo.name)
+        self.assertEqual(self.store('listings/flat.jpg', color='blue'), jpeg.main_photo.name)
+        new_names = render_variants(jpeg.main_photo)['webp']
+        self.assertTrue(set(jpeg_names.values()).isdisjoint(new_names.values()))
+        with self.storage.open(new_names['32'], 'rb') as stored, Image.open(stored) as image:
+            self.assertGreater(image.convert('RGB').getpixel((0, 0))[2], 200)
+
+    def test_build_records_variants_and_queues_replaced_ones(self):
+        listing = make_listing(self.realtor, main_photo=self.store('listings/flat.jpg'))
+        build_variants(listing.pk)
+        listing.refresh_from_db()
+        first = listing.photo_variants['main_photo']
+        self.assertEqual(first['source'], listing.main_photo.name)
+        payload = PublishedListing.objects.get(pk=listing.pk).payload
+        self.assertIn('main_photo', payload['photo_variants'])
+        self.assertEqual(payload['photo_variants'], ListingSerializer(listing).data['photo_variants'])
+
+        listing.main_photo = self.store('listings/other.jpg', color='blue')
+        listing.save()
+        build_variants(listing.pk)
+        listing.refresh_from_db()
+        self.assertEqual(listing.photo_variants['main_photo']['source'], 'listings/other.jpg')
+        old = {name for ext in ('webp', 'jpeg') for name in first[ext].values()}
+        self.assertTrue(old.issubset(PendingFileDeletion.objects.values_list('name', flat=True)))
+
+    @override_settings(LISTING_IMAGE_VARIANTS='inline')
+    def test_inline_builds_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            listing = make_listing(self.realtor, main_photo=self.store('listings/flat.jpg'))
+        listing.refresh_from_db()
+        self.assertEqual(listing.photo_variants['main_photo']['source'], listing.main_photo.name)
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS, LISTING_IMAGE_MAX_DIMENSION=100)
+class ListingUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.realtor)
+
+    def create(self, photo, name='photo.jpg', content_type='image/jpeg'):
+        return self.client.post('/api/listings/manage', {
+            'title': 'Uploaded flat', 'description': 'A flat', 'price': 500, 'location': 'Lagos',
+            'category': 'FOR_SALE', 'main_photo': SimpleUploadedFile(name, photo, content_type=content_type),
+        }, format='multipart')
+
+    def jpeg(self, size, **options):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', **options)
+        return buffer.getvalue()
+
+    def test_photo_is_capped_rotated_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90° clockwise
+        exif[0x010F] = 'Camera maker'
+        response = self.create(self.jpeg((400, 200), exif=exif.tobytes()))
+        self.assertEqual(response.status_code, 201, response.content)
+
+        listing = Listing.objects.get()
+        self.assertTrue(listing.main_photo.name.endswith('.jpg'))
+        with listing.main_photo.open('rb') as stored, Image.open(stored) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (50, 100))
+            self.assertEqual(dict(image.getexif()), {})
+
+    def test_transparent_png_is_flattened(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (20, 20), (0, 0, 0, 0)).save(buffer, 'PNG')
+        response = self.create(buffer.getvalue(), name='plan.png', content_type='image/png')
+        self.assertEqual(response.status_code, 201, response.content)
+        listing = Listing.objects.get()
+        self.assertEqual(listing.main_photo.name, 'listings/plan.jpg')
+        with listing.main_photo.open('rb') as stored, Image.open(stored) as image:
+            self.assertEqual(image.getpixel((0, 0)), (255, 255, 255))
+
+    def test_rejects_decompression_bomb_from_header(self):
+        # A PNG whose header claims 30000x30000 pixels; nothing is decoded.
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+        header = struct.pack('>IIBBBBB', 30000, 30000, 8, 2, 0, 0, 0)
+        photo = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(b'\0' * 64))
+        response = self.create(photo, name='bomb.png', content_type='image/png')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['main_photo'], ['Image has too many pixels.'])
+
+    @override_settings(LISTING_IMAGE_MAX_PIXELS=100)
+    def test_rejects_too_many_pixels(self):
+        response = self.create(self.jpeg((20, 20)))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Listing.objects.exists())
+
+    def test_rejects_other_files(self):
+        response = self.create(b'GIF89a' + b'\0' * 64, name='photo.gif', content_type='image/gif')
+        self.assertEqual(response.status_code, 400)
+        response = self.create(b'not an image')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(LISTING_UPLOAD_MAX_FILE_SIZE=1024)
+    def test_file_size_limit(self):
+        response = self.create(os.urandom(4096))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Listing.objects.exists())
+
+    @override_settings(LISTING_UPLOAD_MAX_REQUEST_SIZE=1024)
+    def test_request_size_limit(self):
+        response = self.create(os.urandom(4096))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Listing.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS, LISTING_PRICE_BUCKETS=(0, 1000, 5000))
+class ListingFacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        make_listing(cls.realtor, title='Cheap flat', price=500, bedrooms=1, bathrooms=1, category='FOR_RENT')
+        make_listing(cls.realtor, title='Family flat', price=2000, bedrooms=3, bathrooms='2.5', category='FOR_RENT')
+        make_listing(cls.realtor, title='Big house', price=9000, bedrooms=7, bathrooms=5, category='FOR_SALE')
+        make_listing(cls.realtor, title='Hidden flat', price=100, is_published=False)
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+
+    def test_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/listings/search/facets').json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['price']['min'], '500.00')
+        self.assertEqual(data['price']['max'], '9000.00')
+        self.assertEqual([b['count'] for b in data['price']['buckets']], [1, 1, 1])
+        self.assertEqual(data['category'], {'FOR_SALE': 1, 'FOR_RENT': 2, 'FOR_BUY': 0})
+        self.assertEqual(data['bedrooms'], {'0': 0, '1': 1, '2': 0, '3': 1, '4': 0, '5+': 1})
+        self.assertEqual(data['bathrooms'], {'0': 0, '1': 1, '2': 1, '3': 0, '4+': 1})
+
+    def test_facet_ignores_its_own_filter(self):
+        data = self.client.get('/api/listings/search/facets?category=for_rent&search=flat').json()
+        self.assertEqual(data['count'], 2)
+        # Other categories stay visible; they just have no flats.
+        self.assertEqual(data['category'], {'FOR_SALE': 0, 'FOR_RENT': 2, 'FOR_BUY': 0})
+        self.assertEqual(data['bedrooms']['5+'], 0)
+
+    def test_equivalent_filters_share_a_cache_entry(self):
+        self.client.get('/api/listings/search/facets?category=FOR_RENT&bathrooms=2')
+        response = self.client.get('/api/listings/search/facets?bathrooms=2.0&category=for_rent&page_size=5')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_min_price(self):
+        data = self.client.get('/api/listings/search?min_price=1000&max_price=5000').json()
+        self.assertEqual([r['title'] for r in data['results']], ['Family flat'])
+        response = self.client.get('/api/listings/search/facets?min_price=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Invalid min_price parameter.')
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class ListingGeoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        make_listing(cls.realtor, title='Victoria Island flat', latitude=6.4281, longitude=3.4219)
+        make_listing(cls.realtor, title='Lekki flat', latitude=6.4698, longitude=3.5852)
+        make_listing(cls.realtor, title='Ikeja flat', latitude=6.6018, longitude=3.3515)
+        make_listing(cls.realtor, title='Abuja flat', latitude=9.0765, longitude=7.3986)
+        make_listing(cls.realtor, title='Somewhere', location='Unknown')
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+
+    def titles(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [r['title'] for r in response.json()['results']]
+
+    def test_geohash(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(Listing.objects.get(title='Somewhere').geohash, '')
+        self.assertTrue(Listing.objects.get(title='Lekki flat').geohash.startswith('s14'))
+
+    def test_prefix_ranges_use_geohash_characters(self):
+        # Bounds stay within the base32 alphabet so the range means the same
+        # under any collation, not just byte order.
+        self.assertEqual(next_prefix('s14'), 's15')
+        self.assertEqual(next_prefix('s19'), 's1b')
+        self.assertEqual(next_prefix('s1z'), 's2')
+        self.assertEqual(next_prefix('zz'), None)
+        self.assertEqual(
+            geohash_condition(['s1z', 'zz']),
+            Q(geohash__gte='s1z', geohash__lt='s2') | Q(geohash__gte='zz'),
+        )
+
+    def test_radius_orders_by_distance(self):
+        response = self.client.get('/api/listings/search?lat=6.4281&lng=3.4219&radius_km=20')
+        results = response.json()['results']
+        self.assertEqual([r['title'] for r in results], ['Victoria Island flat', 'Lekki flat'])
+        self.assertEqual(results[0]['distance_km'], 0)
+        self.assertAlmostEqual(results[1]['distance_km'], 19.0, delta=0.5)
+
+    def test_bbox(self):
+        self.assertEqual(
+            sorted(self.titles('/api/listings/search?bbox=3.3,6.4,3.5,6.7')),
+            ['Ikeja flat', 'Victoria Island flat'],
+        )
+
+    def test_invalid_area(self):
+        self.assertEqual(self.client.get('/api/listings/search?lat=6.4&lng=3.4').status_code, 400)
+        self.assertEqual(self.client.get('/api/listings/search?bbox=1,2,3').status_code, 400)
+
+    def test_geocode_from_gazetteer(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('name,latitude,longitude,alternate_names\nLagos,6.455,3.394,Eko|Lagos State\n')
+        self.addCleanup(os.remove, f.name)
+        listing = make_listing(self.realtor, title='Island flat', location='Marina, Eko')
+        call_command('geocode_listings', gazetteer=f.name, stdout=StringIO(), stderr=StringIO())
+        listing.refresh_from_db()
+        self.assertEqual((listing.latitude, listing.longitude), (6.455, 3.394))
+        self.assertEqual(listing.geohash, encode_geohash(6.455, 3.394))
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS, METRICS_TOKEN='secret')
+class RequestMetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        make_listing(cls.realtor, title='Measured flat')
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/listings/get-listings')
+        timing = dict(
+            part.strip().split(';', 1) for part in response['Server-Timing'].split(',')
+        )
+        self.assertEqual(set(timing), {'app', 'db', 'render', 'total'})
+        self.assertRegex(timing['db'], r'desc="[1-9]\d* queries"')
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/listings/get-listings')
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreT').status_code, 404)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        body = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'http_requests_total{view="listings.views.ListingsView",method="GET",status="200"}', body
+        )
+        self.assertRegex(
+            body,
+            r'http_request_duration_seconds_count\{view="listings.views.ListingsView",method="GET"\} [1-9]',
+        )
+        self.assertIn('http_response_size_bytes_bucket{view="listings.views.ListingsView",method="GET",le="+Inf"}', body)
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class QueryInspectorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        for i in range(8):
+            make_listing(realtor, title=f'Flat {i}')
+
+    def test_sql_shape(self):
+        self.assertEqual(
+            sql_shape('SELECT "a"."photo_1" FROM "a"  WHERE "a"."id" IN (%s, %s, %s) AND "a"."n" > 10 LIMIT 21'),
+            'SELECT "a"."photo_1" FROM "a" WHERE "a"."id" IN (...) AND "a"."n" > ? LIMIT ?',
+        )
+
+    def test_detects_n_plus_one(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'possible N+1'), \
+                self.assertLogs('realestate.queries', 'WARNING'):
+            with inspect_queries('realtor names', max_repeats=5):
+                [listing.realtor.name for listing in Listing.objects.all()]
+
+        with inspect_queries('realtor names', max_repeats=5):
+            [listing.realtor.name for listing in Listing.objects.select_related('realtor')]
+
+    def test_query_budget(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, '2 queries, budget is 1'):
+            with inspect_queries('budget', max_queries=1):
+                Listing.objects.count()
+                Listing.objects.count()
+
+    @override_settings(QUERY_INSPECTOR_SLOW_MS=0)
+    def test_slow_queries_are_logged_with_plan(self):
+        with self.assertLogs('realestate.queries', 'WARNING') as logs:
+            self.client.get('/api/listings/get-listings')
+        self.assertTrue(any('slow query' in line and 'listings_publishedlisting' in line for line in logs.output))
+
+    @override_settings(QUERY_INSPECTOR_MAX_QUERIES=1)
+    def test_middleware_enforces_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/listings/search?search=flat&page_size=2')
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS, ROOT_URLCONF='listings.tests')
+class AsyncListingViewTests(TestCase):
+    """
+    The async read views answer exactly like the sync ones, with the same
+    query counts, through the async middleware stack.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        for i in range(25):
+            make_listing(cls.realtor, title=f'Flat {i}', price=1000 + i, latitude=6.4 + i * 0.001, longitude=3.4)
+        cls.slug = Listing.objects.values_list('slug', flat=True).first()
+
+    def setUp(self):
+        get_cache().clear()
+
+    async def compare(self, path, **headers):
+        response = await self.async_client.get(f'/api/listings/{path}', headers=headers)
+        get_cache().clear()
+        expected = await sync_to_async(APIClient().get)(f'/sync/api/listings/{path}', headers=headers)
+        self.assertEqual(response.status_code, expected.status_code)
+        # Only the next/previous links differ, by the /sync prefix.
+        self.assertEqual(response.json(), json.loads(expected.content.decode().replace('/sync/api/', '/api/')))
+        return response
+
+    async def test_responses_match_sync_views(self):
+        token = str(AccessToken.for_user(self.realtor))
+        paths = [
+            'get-listings', 'get-listings?fields=title,price', 'get-listings?cursor=bad',
+            'search?search=flat&page_size=5', 'search?max_price=1004', 'search?search=castle',
+            'search?lat=6.41&lng=3.4&radius_km=1', 'search?bbox=bad',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                await self.compare(path)
+        await self.compare(f'detail?slug={self.slug}', Authorization=f'Bearer {token}')
+        await self.compare('detail?slug=missing', Authorization=f'Bearer {token}')
+
+    async def test_pagination_and_counts(self):
+        response = await self.async_client.get('/api/listings/search?search=flat&page_size=10')
+        self.assertEqual(response.json()['count'], 25)
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        next_path = response.json()['next'].split('testserver')[1]
+        response = await self.async_client.get(next_path)
+        self.assertEqual(len(response.json()['results']), 10)
+
+    async def test_cache_and_conditional_get(self):
+        first = await self.async_client.get('/api/listings/get-listings')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = await self.async_client.get('/api/listings/get-listings')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertIn('desc="0 queries"', second['Server-Timing'])
+        self.assertEqual(second.content, first.content)
+        revalidated = await self.async_client.get(
+            '/api/listings/get-listings', headers={'If-None-Match': first['ETag']}
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+    async def test_server_timing_includes_render(self):
+        render = JSONRenderer.render
+
+        def slow_render(renderer, *args, **kwargs):
+            time.sleep(0.02)
+            return render(renderer, *args, **kwargs)
+
+        with mock.patch.object(JSONRenderer, 'render', slow_render):
+            response = await self.async_client.get('/api/listings/get-listings')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(float(re.search(r'render;dur=([\d.]+)', response['Server-Timing'])[1]), 20)
+
+    async def test_detail_requires_authentication(self):
+        response = await self.async_client.get(f'/api/listings/detail?slug={self.slug}')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = await self.async_client.get(
+            f'/api/listings/detail?slug={self.slug}', headers={'Authorization': 'Bearer nope'}
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['code'], 'token_not_valid')
+
+
+class ListingSearchTests(TestCase):
+    """
+    The full-text index ranks matches and follows writes to the listings
+    table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        cls.in_description = make_listing(cls.realtor, title='Quiet flat', description='Flat with a small garden')
+        cls.in_title = make_listing(cls.realtor, title='Garden cottage', description='A cottage')
+        cls.other = make_listing(cls.realtor, title='City studio', description='Top floor studio')
+
+    def search(self, query):
+        results = search_listings(Listing.objects.all(), query).order_by('-search_rank', '-id')
+        return [listing.pk for listing in results]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('garden'), [self.in_title.pk, self.in_description.pk])
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search('gard'), [self.in_title.pk, self.in_description.pk])
+        self.assertEqual(self.search('city stu'), [self.other.pk])
+        self.assertEqual(self.search('stu city'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.other.title = 'Garden studio'
+        self.other.save()
+        Listing.objects.filter(pk=self.in_title.pk).update(title='Cottage')
+        self.assertEqual(self.search('garden'), [self.other.pk, self.in_description.pk])
+        self.assertEqual(self.search('city'), [])
+
+        self.other.delete()
+        Listing.objects.filter(pk=self.in_description.pk).delete()
+        self.assertEqual(self.search('garden'), [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ListingFieldsTests(TestCase):
+    """
+    The feed and search render the compact field set, or the ?fields=
+    subset asked for.
+    """
+    # URL and the key the listings are rendered under.
+    urls = (('/api/listings/get-listings', 'listings'), ('/api/listings/search', 'results'))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        make_listing(cls.realtor, title='Flat')
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+
+    def test_default_fields(self):
+        for url, key in self.urls:
+            listing = self.client.get(url).json()[key][0]
+            self.assertEqual(set(listing), set(ListingListSerializer.default_fields))
+
+    def test_fields_subset(self):
+        for url, key in self.urls:
+            listing = self.client.get(f'{url}?fields=title,price').json()[key][0]
+            self.assertEqual(set(listing), {'title', 'price'})
+
+    def test_unknown_or_empty_fields_return_400(self):
+        for url, _ in self.urls:
+            for value in ('bogus', 'title,bogus', ','):
+                response = self.client.get(f'{url}?fields={value}')
+                self.assertEqual(response.status_code, 400, (url, value))
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS)
+class ListingExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+        cls.admin = UserAccount.objects.create_superuser('admin@example.com', 'Admin', 'password123')
+        for i in range(5):
+            make_listing(cls.realtor, title=f'Flat {i}', price=1000 + i)
+        make_listing(cls.realtor, title='Draft', is_published=False)
+
+    def setUp(self):
+        self.token = str(AccessToken.for_user(self.admin))
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/listings/export{query}')
+        self.assertEqual(response.status_code, 200)
+        return response['Content-Type'], b''.join(response.streaming_content)
+
+    def test_admin_only(self):
+        self.assertEqual(APIClient().get('/api/listings/export').status_code, 401)
+        client = APIClient()
+        client.force_authenticate(self.realtor)
+        self.assertEqual(client.get('/api/listings/export').status_code, 403)
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/listings/export?output=bogus').status_code, 400)
+        self.assertEqual(self.client.get('/api/listings/export?fields=title,bogus').status_code, 400)
+
+    def test_json_output(self):
+        content_type, body = self.export()
+        self.assertEqual(content_type, 'application/json')
+        listings = json.loads(body)['listings']
+        self.assertEqual([listing['title'] for listing in listings], [f'Flat {i}' for i in reversed(range(5))])
+        expected = ListingListSerializer(Listing.objects.get(title='Flat 4')).data
+        self.assertEqual(listings[0], json.loads(JSONRenderer().render(expected)))
+
+    def test_ndjson_output_has_one_object_per_line(self):
+        content_type, body = self.export('?output=ndjson')
+        self.assertEqual(content_type, 'application/x-ndjson')
+        self.assertTrue(body.endswith(b'\n'))
+        lines = body.decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(all(isinstance(json.loads(line), dict) for line in lines))
+
+    def test_fields(self):
+        for output in ('json', 'ndjson'):
+            _, body = self.export(f'?output={output}&fields=title,price')
+            listings = json.loads(body)['listings'] if output == 'json' else map(json.loads, body.splitlines())
+            for listing in listings:
+                self.assertEqual(list(listing), ['title', 'price'])
+
+    def test_more_rows_than_chunk_size(self):
+        with mock.patch.object(ListingsExportView, 'chunk_size', 2), \
+                mock.patch.object(ListingsExportView, 'write_size', 2):
+            _, body = self.export()
+            self.assertEqual(len(json.loads(body)['listings']), 5)
+            _, body = self.export('?output=ndjson')
+            self.assertEqual(len(body.splitlines()), 5)
+
+    async def test_streams_from_async_iterator_under_asgi(self):
+        with mock.patch.object(ListingsExportView, 'chunk_size', 2), \
+                mock.patch.object(ListingsExportView, 'write_size', 2):
+            response = await self.async_client.get(
+                '/api/listings/export?output=ndjson', headers={'Authorization': f'Bearer {self.token}'}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        # Three writes of at most two rows, and no opening/closing for NDJSON.
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks if chunk], [2, 2, 1])
+        titles = [json.loads(line)['title'] for line in b''.join(chunks).splitlines()]
+        self.assertEqual(titles, [f'Flat {i}' for i in reversed(range(5))])
+
+
+@override_settings(CACHES=TEST_CACHES, **QUERY_CHECKS, LISTING_FILE_CLEANUP_ON_COMMIT=False)
+class BulkManageListingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = get_storage()
+        self.listing = make_listing(self.realtor, title='Flat', main_photo=self.storage.save(
+            'listings/flat.jpg', ContentFile(self.png())
+        ))
+        self.client = APIClient()
+        self.client.force_authenticate(self.realtor)
+
+    def png(self, color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def bulk(self, operations, **files):
+        return self.client.post('/api/listings/manage/bulk', {
+            'operations': json.dumps(operations),
+            **{key: SimpleUploadedFile(f'{key}.png', data, content_type='image/png') for key, data in files.items()},
+        }, format='multipart')
+
+    def create_op(self, title='Bulk flat'):
+        return {'op': 'create', 'data': {
+            'title': title, 'description': 'A flat', 'price': 500, 'location': 'Lagos', 'category': 'FOR_SALE',
+        }}
+
+    def test_reports_errors_per_item_and_applies_nothing(self):
+        response = self.bulk([
+            self.create_op(),
+            {'op': 'update', 'slug': self.listing.slug, 'data': {'price': 'lots'}},
+            {'op': 'delete', 'slug': 'missing'},
+            {'op': 'archive', 'slug': self.listing.slug},
+        ], **{'0.main_photo': self.png()})
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertNotIn('status', results[0])
+        self.assertEqual([result.get('status') for result in results[1:]], ['error'] * 3)
+        self.assertIn('price', results[1]['errors'])
+        self.assertEqual(results[2]['errors'], {'slug': ['Listing not found.']})
+        self.assertIn('op', results[3]['errors'])
+        self.assertEqual(Listing.objects.count(), 1)
+        self.assertEqual(Listing.objects.get().price, 100)
+
+    def test_failure_while_applying_rolls_everything_back(self):
+        other = make_listing(self.realtor, title='Other')
+        with mock.patch('listings.views.BulkManageListingView.apply_deletes', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.bulk([
+                self.create_op(),
+                {'op': 'update', 'slug': self.listing.slug, 'data': {'price': 200}},
+                {'op': 'delete', 'slug': other.slug},
+            ], **{'0.main_photo': self.png(), '1.main_photo': self.png('blue')})
+        self.assertEqual(
+            sorted(Listing.objects.values_list('slug', 'price', 'main_photo')),
+            sorted([(self.listing.slug, 100, 'listings/flat.jpg'), (other.slug, 100, 'listings/photo.jpg')]),
+        )
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_multipart_photos_are_stored_per_operation(self):
+        response = self.bulk([
+            self.create_op(),
+            {'op': 'update', 'slug': self.listing.slug, 'data': {'title': 'Flat'}},
+        ], **{'0.main_photo': self.png('blue'), '1.photo_1': self.png('green')})
+        self.assertEqual(response.status_code, 200, response.content)
+        created = Listing.objects.get(slug=response.json()['results'][0]['slug'])
+        updated = Listing.objects.get(pk=self.listing.pk)
+        for photo, color in ((created.main_photo, (0, 0, 255)), (updated.photo_1, (0, 128, 0))):
+            self.assertTrue(photo.name.endswith('.jpg'))
+            with photo.open('rb') as stored, Image.open(stored) as image:
+                self.assertEqual(image.format, 'JPEG')
+                pixel = image.getpixel((4, 4))
+            self.assertLessEqual(max(abs(a - b) for a, b in zip(pixel, color)), 10)
+        self.assertEqual(updated.main_photo.name, 'listings/flat.jpg')
+
+    def test_replaced_and_deleted_files_are_queued(self):
+        other = make_listing(self.realtor, title='Other', main_photo=self.storage.save(
+            'listings/other.jpg', ContentFile(self.png())
+        ))
+        response = self.bulk([
+            {'op': 'update', 'slug': self.listing.slug, 'data': {'title': 'Flat'}},
+            {'op': 'delete', 'slug': other.slug},
+        ], **{'0.main_photo': self.png('blue')})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            sorted(PendingFileDeletion.objects.values_list('name', flat=True)),
+            ['listings/flat.jpg', 'listings/other.jpg'],
+        )
+        self.assertEqual(delete_pending(), 2)
+        self.assertFalse(self.storage.exists('listings/flat.jpg'))
+        self.assertTrue(self.storage.exists(Listing.objects.get(pk=self.listing.pk).main_photo.name))
+
+    def test_create_retries_slugs_taken_concurrently(self):
+        from .slugs import allocate_slugs
+
+        calls = []
+
+        def racing_allocate(model, titles, using=None):
+            calls.append(titles)
+            if len(calls) == 1:
+                # Another request inserted the same slug after this lookup.
+                return [self.listing.slug]
+            return allocate_slugs(model, titles, using)
+
+        with mock.patch('listings.views.allocate_slugs', side_effect=racing_allocate):
+            response = self.bulk([self.create_op(title='Flat')], **{'0.main_photo': self.png()})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(response.json()['results'][0]['slug'], 'flat-1')
+        self.assertEqual(Listing.objects.count(), 2)
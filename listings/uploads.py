@@ -0,0 +1,140 @@
+"""
+Listing photo uploads.
+
+Limits are enforced while the request body streams in: ListingUploadHandler
+counts the bytes of every file part and aborts the parse with a 413 as
+soon as one photo exceeds LISTING_UPLOAD_MAX_FILE_SIZE or the request
+exceeds LISTING_UPLOAD_MAX_REQUEST_SIZE (straight away, when the
+Content-Length already says so). Parts are still spooled by Django's own
+handlers, in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE and to a temporary
+file beyond, so memory per upload stays bounded.
+
+process_photo() then validates each photo from its header alone (format,
+dimensions, pixel count) before anything is decoded, so decompression
+bombs are rejected without allocating their pixels. Accepted photos are
+decoded at reduced size where the format allows it, rotated upright,
+capped to LISTING_IMAGE_MAX_DIMENSION and re-encoded as JPEG without
+their EXIF metadata (camera details, GPS position). The re-encoded file
+is what gets stored; listings.images derives the resized variants from it.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import MultiPartParser
+
+MB = 1024 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = 413
+    default_detail = 'Upload too large.'
+    default_code = 'upload_too_large'
+
+
+class ListingUploadHandler(FileUploadHandler):
+    """
+    Passes file data through to the next handler, counting it.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.received = 0
+        if content_length and content_length > settings.LISTING_UPLOAD_MAX_REQUEST_SIZE:
+            raise self.request_too_large()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        self.received += len(raw_data)
+        if self.file_size > settings.LISTING_UPLOAD_MAX_FILE_SIZE:
+            raise UploadTooLarge(
+                f'{self.field_name} is larger than {settings.LISTING_UPLOAD_MAX_FILE_SIZE // MB} MB.'
+            )
+        if self.received > settings.LISTING_UPLOAD_MAX_REQUEST_SIZE:
+            raise self.request_too_large()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def request_too_large(self):
+        return UploadTooLarge(
+            f'Uploads are limited to {settings.LISTING_UPLOAD_MAX_REQUEST_SIZE // MB} MB per request.'
+        )
+
+
+class ListingMultiPartParser(MultiPartParser):
+    """
+    MultiPartParser with ListingUploadHandler in front of the configured
+    upload handlers.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request.upload_handlers = [ListingUploadHandler(request), *request.upload_handlers]
+        return super().parse(stream, media_type, parser_context)
+
+
+def process_photo(upload):
+    """
+    Validate ``upload`` from its header and return it re-encoded as a
+    capped, EXIF-free JPEG. Raises ValueError with the message for the
+    client.
+    """
+    upload.seek(0)
+    try:
+        # Only reads the header; pixels are decoded on load().
+        image = Image.open(upload)
+    except Image.DecompressionBombError:
+        raise ValueError('Image has too many pixels.')
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise ValueError('Upload a valid JPEG, PNG or WebP image.')
+
+    if image.format not in settings.LISTING_IMAGE_FORMATS:
+        raise ValueError('Upload a valid JPEG, PNG or WebP image.')
+    width, height = image.size
+    if not width or not height or width * height > settings.LISTING_IMAGE_MAX_PIXELS:
+        raise ValueError('Image has too many pixels.')
+
+    cap = settings.LISTING_IMAGE_MAX_DIMENSION
+    try:
+        # JPEG decodes straight to the smallest scale still covering the
+        # cap; square so that holds after EXIF rotation too.
+        image.draft('RGB', (cap, cap))
+        # A CMYK profile doesn't describe the RGB pixels written below.
+        icc_profile = None if image.mode == 'CMYK' else image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((cap, cap), Image.LANCZOS)
+        image = _flatten(image)
+        buffer = BytesIO()
+        # No exif= here, so none of the original metadata is written.
+        image.save(
+            buffer, 'JPEG', quality=settings.LISTING_IMAGE_QUALITY, optimize=True, progressive=True,
+            icc_profile=icc_profile,
+        )
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise ValueError('Upload a valid JPEG, PNG or WebP image.')
+
+    stem = os.path.splitext(os.path.basename(upload.name or 'photo'))[0] or 'photo'
+    return SimpleUploadedFile(f'{stem}.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+def _flatten(image):
+    """
+    ``image`` as RGB or L, with any transparency composited onto white.
+    """
+    if image.mode in ('RGB', 'L'):
+        return image
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
@@ -1,9 +1,29 @@
+from django.conf import settings
 from django.urls import path
-from .views import ManageListingView, ListingDetailView, ListingsView, SearchListingsView
+from .views import (
+    ManageListingView, BulkManageListingView, ListingDetailView, ListingsView, SearchListingsView,
+    ListingFacetsView, ListingsExportView, ListingCacheStatsView,
+    AsyncListingDetailView, AsyncListingsView, AsyncSearchListingsView,
+)
 
-urlpatterns = [
-    path('manage', ManageListingView.as_view()),
+read_patterns = [
     path('detail', ListingDetailView.as_view()),
     path('get-listings', ListingsView.as_view()),
-    path('search', SearchListingsView.as_view())
+    path('search', SearchListingsView.as_view()),
+]
+
+# Under ASGI the public read endpoints are served by the async views.
+async_read_patterns = [
+    path('detail', AsyncListingDetailView.as_view()),
+    path('get-listings', AsyncListingsView.as_view()),
+    path('search', AsyncSearchListingsView.as_view()),
+]
+
+urlpatterns = [
+    path('manage', ManageListingView.as_view()),
+    path('manage/bulk', BulkManageListingView.as_view()),
+    *(async_read_patterns if settings.ASGI else read_patterns),
+    path('search/facets', ListingFacetsView.as_view()),
+    path('export', ListingsExportView.as_view()),
+    path('cache-stats', ListingCacheStatsView.as_view()),
 ]
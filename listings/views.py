@@ -1,13 +1,29 @@
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, models, transaction
+from django.http import StreamingHttpResponse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from .models import Listing
-from .serializers import ListingSerializer
-from django.db.models import Q
+from rest_framework.parsers import FormParser, JSONParser
+from .models import SLUG_ATTEMPTS, Listing, PublishedListing
+from .serializers import ListingSerializer, ListingListSerializer, PublishedListingSerializer
+from users.authentication import authenticate_request
+from .cache import acached_response, cached_response, cache_stats, invalidate_on_commit, json_response
+from .cleanup import queue_file_deletion
+from .pagination import InvalidCursor, KeysetPagination
+from .images import schedule_variants
+from .readmodel import sync_published
+from .filters import filter_listings, filter_signature, listing_facets, parse_filters
+from .slugs import allocate_slugs
+from .uploads import ListingMultiPartParser
 from .permissions import IsRealtor
 
 class ManageListingView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, FormParser, ListingMultiPartParser]
 
     def get(self, request):
         """
@@ -112,28 +128,207 @@ class ManageListingView(APIView):
         return Response({'success': 'Listing deleted successfully.'}, status=status.HTTP_204_NO_CONTENT)
 
 
+class BulkManageListingView(APIView):
+    """
+    Apply many create/update/delete operations for the logged-in realtor
+    in one request and one transaction.
+
+    Body: {"operations": [
+        {"op": "create", "data": {...}},
+        {"op": "update", "slug": "...", "data": {...}},
+        {"op": "delete", "slug": "..."}
+    ]}
+    For multipart requests "operations" is a JSON string and photos are
+    sent as files named "<index>.<field>", e.g. "0.main_photo".
+
+    Every operation is validated first; if any fails nothing is written
+    and the per-item results carry the errors.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, FormParser, ListingMultiPartParser]
+    max_operations = 500
+
+    def post(self, request):
+        user = request.user
+        if user.role != 'realtor':
+            return Response({'error': 'Only realtors can manage listings.'}, status=status.HTTP_403_FORBIDDEN)
+
+        operations = request.data.get('operations')
+        if isinstance(operations, str):
+            try:
+                operations = json.loads(operations)
+            except ValueError:
+                operations = None
+        if not isinstance(operations, list) or not operations:
+            return Response({'error': 'A non-empty operations list is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > self.max_operations:
+            return Response(
+                {'error': f'At most {self.max_operations} operations are allowed per request.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        slugs = [op.get('slug') for op in operations if isinstance(op, dict) and isinstance(op.get('slug'), str)]
+        existing = {listing.slug: listing for listing in Listing.objects.filter(realtor=user, slug__in=slugs)}
+        duplicates = {slug for slug in slugs if slugs.count(slug) > 1}
+
+        results, plans = [], []
+        for index, op in enumerate(operations):
+            result = {'index': index, 'op': op.get('op') if isinstance(op, dict) else None}
+            listing, serializer, errors = self.validate_operation(request, result, op, existing)
+            if not errors and result.get('slug') in duplicates:
+                errors = {'slug': ['Only one operation per listing is allowed.']}
+            if errors:
+                result.update(status='error', errors=errors)
+            results.append(result)
+            plans.append((result, listing, serializer))
+
+        if any(result.get('status') == 'error' for result in results):
+            return Response(
+                {'error': 'No operations were applied.', 'results': results},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            created = self.apply_creates(user, [p for p in plans if p[0]['op'] == 'create'])
+            changed = self.apply_updates([p for p in plans if p[0]['op'] == 'update'])
+            self.apply_deletes(user, [p for p in plans if p[0]['op'] == 'delete'])
+            # Deleted listings take their read model rows with them.
+            sync_published([listing.pk for listing in [*created, *changed]])
+
+            invalidate_on_commit([result['slug'] for result in results])
+            for listing in [*created, *changed]:
+                schedule_variants(listing)
+
+        for result in results:
+            result['status'] = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}[result['op']]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    def validate_operation(self, request, result, op, existing):
+        """
+        Check one operation and fill in ``result``. Returns
+        (listing, serializer, errors).
+        """
+        if result['op'] not in ('create', 'update', 'delete'):
+            return None, None, {'op': ['Must be one of create, update, delete.']}
+
+        listing = None
+        if result['op'] != 'create':
+            slug = op.get('slug')
+            result['slug'] = slug
+            if slug not in existing:
+                return None, None, {'slug': ['Listing not found.']}
+            listing = existing[slug]
+            if result['op'] == 'delete':
+                return listing, None, None
+
+        data = op.get('data')
+        if not isinstance(data, dict):
+            return listing, None, {'data': ['An object with the listing fields is required.']}
+        data = {**data, **self.files_for(request, result['index'])}
+
+        if listing is None:
+            serializer = ListingSerializer(data=data, context={'request': request})
+        else:
+            serializer = ListingSerializer(listing, data=data, partial=True, context={'request': request})
+        if not serializer.is_valid():
+            return listing, None, serializer.errors
+        return listing, serializer, None
+
+    def files_for(self, request, index):
+        prefix = f'{index}.'
+        return {
+            key[len(prefix):]: uploaded
+            for key, uploaded in request.FILES.items() if key.startswith(prefix)
+        }
+
+    def apply_creates(self, user, plans):
+        if not plans:
+            return []
+        titles = [serializer.validated_data['title'] for _, _, serializer in plans]
+        listings = [
+            Listing(**serializer.validated_data, realtor=user, realtor_email=user.email)
+            for _, _, serializer in plans
+        ]
+        for listing in listings:
+            listing.update_geohash()
+        # As in Listing.save: a concurrent insert can take one of the slugs
+        # between allocation and insert; allocate again and retry.
+        for _ in range(SLUG_ATTEMPTS):
+            for listing, slug in zip(listings, allocate_slugs(Listing, titles)):
+                listing.slug = slug
+            try:
+                # bulk_create runs each field's pre_save, which also commits uploaded photos to storage.
+                with transaction.atomic():
+                    Listing.objects.bulk_create(listings)
+                break
+            except IntegrityError:
+                if not Listing.objects.filter(slug__in=[listing.slug for listing in listings]).exists():
+                    raise
+        else:
+            raise IntegrityError("Could not generate a unique slug")
+        for (result, _, _), listing in zip(plans, listings):
+            result['slug'] = listing.slug
+        return listings
+
+    def apply_updates(self, plans):
+        if not plans:
+            return []
+        listings, fields, orphaned = [], set(), []
+        for _, listing, serializer in plans:
+            for name, value in serializer.validated_data.items():
+                field = Listing._meta.get_field(name)
+                old = getattr(listing, name)
+                setattr(listing, name, value)
+                if isinstance(field, models.FileField):
+                    if old and old.name != getattr(listing, name).name:
+                        orphaned.append(old.name)
+                    # bulk_update doesn't call pre_save; commit new uploads ourselves.
+                    field.pre_save(listing, add=False)
+                fields.add(name)
+            listings.append(listing)
+        if fields & {'latitude', 'longitude'}:
+            for listing in listings:
+                listing.update_geohash()
+            fields.add('geohash')
+        if fields:
+            Listing.objects.bulk_update(listings, sorted(fields))
+        queue_file_deletion(orphaned)
+        return listings
+
+    def apply_deletes(self, user, plans):
+        if not plans:
+            return
+        # The post_delete receiver queues the files and expires the caches.
+        Listing.objects.filter(realtor=user, slug__in=[listing.slug for _, listing, _ in plans]).delete()
+
+
 class ListingDetailView(APIView):
     def get(self, request,format=None):
-        try:
-            slug = request.query_params.get('slug')
+        slug = request.query_params.get('slug')
 
-            if not slug:
-                return Response(
-                    {'error': 'Slug parameter is required.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        if not slug:
+            return Response(
+                {'error': 'Slug parameter is required.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return cached_response(
+            request, 'detail', lambda: self.get_listing(slug), slug=slug, private=True
+        )
 
-            if not Listing.objects.filter(slug=slug, is_published=True).exists():
+    def get_listing(self, slug):
+        try:
+            payload = PublishedListing.objects.filter(slug=slug).values_list('payload', flat=True).first()
+            if payload is None:
                 return Response(
                     {'error':'Published listing with this slug does not exist'},
                     status=status.HTTP_404_NOT_FOUND
                 )
-            
-            listing = Listing.objects.get(slug=slug, is_published=True)
-            serializer = ListingSerializer(listing)
+
+            serializer = PublishedListingSerializer(detail=True)
 
             return Response(
-                {'listing': serializer.data},
+                {'listing': serializer.to_representation(payload)},
                 status=status.HTTP_200_OK
             )
 
@@ -147,20 +342,45 @@ class ListingsView(APIView):
     permission_classes = (permissions.AllowAny,)
 
     def get(self, request, format=None):
+        return cached_response(request, 'feed', lambda: self.get_listings(request))
+
+    def get_listings(self, request):
         try:
-            if not Listing.objects.filter(is_published=True).exists():
+            fields = ListingListSerializer.parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            paginator = KeysetPagination()
+            listings = paginator.paginate_queryset(
+                PublishedListing.objects.values('id', 'created_at', 'payload'),
+                request
+            )
+            if not listings and paginator.is_first_page:
                 return Response(
                     {'error': 'No published listings found in the database.'},
                     status=status.HTTP_404_NOT_FOUND
                 )
-            
-            listings = Listing.objects.filter(is_published=True).order_by('-created_at')
-            serializer = ListingSerializer(listings, many=True)
+
+            serializer = PublishedListingSerializer(fields)
             return Response(
-                {'listings': serializer.data},
+                {
+                    'listings': serializer.serialize(listings),
+                    'next': paginator.get_next_link(),
+                    'previous': paginator.get_previous_link(),
+                },
                 status=status.HTTP_200_OK
             )
-        
+
+        except InvalidCursor as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         except Exception as e:
             return Response(
                 {'error': 'An error occurred while retrieving listings.'},
@@ -172,82 +392,309 @@ class SearchListingsView(APIView):
     permission_classes = (permissions.AllowAny,)
 
     def get(self, request):
-        # Base queryset
-        listings = Listing.objects.filter(is_published=True)
+        return cached_response(request, 'search', lambda: self.search(request))
 
+    def search(self, request):
         # -----------------------
-        # 🔍 SEARCH (REQUIRED)
+        # 🔍 SEARCH + 🎯 FILTERS
         # -----------------------
-        search = request.query_params.get('search')
-
-        if search:
-            listings = listings.filter(
-                Q(title__icontains=search) |
-                Q(description__icontains=search) |
-                Q(location__icontains=search) |
-                Q(category__icontains=search)
+        try:
+            query = search_query(request.query_params)
+        except ValueError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
             )
+
         # -----------------------
-        # 🎯 FILTERS (OPTIONAL)
+        # 📦 PAGINATE + RESPONSE
         # -----------------------
 
-        max_price = request.query_params.get('max_price')
-        if max_price:
-            try:
-                listings = listings.filter(price__lte=float(max_price))
-            except ValueError:
-                return Response(
-                    {'error': 'Invalid max_price parameter.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        paginator = KeysetPagination(ordering=query['ordering'])
+        try:
+            page = paginator.paginate_queryset(query['rows'], request)
+        except InvalidCursor as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        bedrooms = request.query_params.get('bedrooms')
-        if bedrooms:
-            try:
-                listings = listings.filter(bedrooms__gte=int(bedrooms))
-            except ValueError:
-                return Response(
-                    {'error': 'Invalid bedrooms parameter.'},
-                    status=status.HTTP_400_BAD_REQUEST
+        if not page and paginator.is_first_page:
+            return Response(
+                {'error': 'No listings found matching the criteria.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response(
+            {
+                'count': paginator.get_count(query['listings'], page),
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link(),
+                'results': search_results(query, page)
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+def search_query(params):
+    """
+    Parse a search request: {'fields', 'filters', 'listings' (the
+    filtered PublishedListing queryset, for counting), 'rows' (its
+    payloads and sort keys to paginate), 'ordering'}. Raises ValueError
+    for bad parameters.
+    """
+    fields = ListingListSerializer.parse_fields(params.get('fields'))
+    filters = parse_filters(params)
+    listings = filter_listings(filters)
+
+    ordering = None
+    annotations = ()
+    if 'search' in filters:
+        ordering = ('-search_rank', '-created_at', '-id')
+        annotations = ('search_rank',)
+    elif 'near' in filters:
+        ordering = ('distance_km', '-created_at', '-id')
+    if 'near' in filters:
+        annotations += ('distance_km',)
+
+    return {
+        'fields': fields,
+        'filters': filters,
+        'listings': listings,
+        'rows': listings.values('id', 'created_at', 'payload', *annotations),
+        'ordering': ordering,
+    }
+
+
+def search_results(query, page):
+    results = PublishedListingSerializer(query['fields']).serialize(page)
+    if 'near' in query['filters']:
+        for result, row in zip(results, page):
+            result['distance_km'] = round(row['distance_km'], 3)
+    return results
+
+
+class ListingFacetsView(APIView):
+    """
+    Result count, price range/buckets and counts per category, bedrooms
+    and bathrooms for the same filters as the search endpoint, so filter
+    sidebars don't need the result set itself.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request):
+        try:
+            filters = parse_filters(request.query_params)
+        except ValueError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return cached_response(
+            request, 'facets',
+            lambda: Response(listing_facets(filters), status=status.HTTP_200_OK),
+            signature=filter_signature(filters),
+        )
+
+
+class ListingsExportView(APIView):
+    """
+    Stream every published listing as JSON (default) or NDJSON
+    (?output=ndjson). Rows are read with a chunked iterator and encoded as
+    they go, so memory stays flat however large the catalogue is.
+    Accepts the same ?fields= as the feed.
+
+    Under ASGI the body is an async generator over aiterator(): Django
+    would otherwise read a sync iterator to the end before sending
+    anything.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    chunk_size = 2000
+    # Rows handed to the server per write.
+    write_size = 500
+    content_types = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+    def get(self, request):
+        try:
+            fields = ListingListSerializer.parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        output = request.query_params.get('output', 'json')
+        if output not in self.content_types:
+            return Response(
+                {'error': 'Invalid output parameter.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = PublishedListingSerializer(fields)
+        payloads = PublishedListing.objects.order_by('-created_at', '-id').values_list('payload', flat=True)
+        if isinstance(request._request, ASGIRequest):
+            stream = self.astream(payloads.aiterator(chunk_size=self.chunk_size), serializer, output)
+        else:
+            stream = self.stream(payloads.iterator(chunk_size=self.chunk_size), serializer, output)
+
+        response = StreamingHttpResponse(stream, content_type=self.content_types[output])
+        response['Content-Disposition'] = f'attachment; filename="listings.{output}"'
+        return response
+
+    def stream(self, payloads, serializer, output):
+        yield self.opening(output)
+        batch, first = [], True
+        for payload in payloads:
+            batch.append(payload)
+            if len(batch) == self.write_size:
+                yield self.encode_batch(batch, serializer, output, first)
+                batch, first = [], False
+        if batch:
+            yield self.encode_batch(batch, serializer, output, first)
+        yield self.closing(output)
+
+    async def astream(self, payloads, serializer, output):
+        yield self.opening(output)
+        batch, first = [], True
+        async for payload in payloads:
+            batch.append(payload)
+            if len(batch) == self.write_size:
+                yield self.encode_batch(batch, serializer, output, first)
+                batch, first = [], False
+        if batch:
+            yield self.encode_batch(batch, serializer, output, first)
+        yield self.closing(output)
+
+    def opening(self, output):
+        return b'{"listings":[' if output == 'json' else b''
+
+    def closing(self, output):
+        return b']}' if output == 'json' else b''
+
+    def encode_batch(self, payloads, serializer, output, first):
+        encoded = [self.encode(serializer.to_representation(payload)) for payload in payloads]
+        if output == 'ndjson':
+            return b'\n'.join(encoded) + b'\n'
+        chunk = b','.join(encoded)
+        return chunk if first else b',' + chunk
+
+    def encode(self, listing):
+        return json.dumps(listing, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class ListingCacheStatsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response({'cache': cache_stats()}, status=status.HTTP_200_OK)
+
+
+# -----------------------
+# Async views (ASGI)
+# -----------------------
+# The public read endpoints again, for the ASGI deployment (settings.ASGI,
+# see listings/urls.py). ORM calls are awaited, so a request waiting on
+# the database or on a slow client holds no thread. DRF's APIView can't
+# run async handlers, hence plain Django views; responses and cache
+# entries are the same as the views above.
+
+class AsyncListingDetailView(View):
+    async def get(self, request):
+        user, error = await authenticate_request(request)
+        if error is not None:
+            return error
+
+        slug = request.GET.get('slug')
+        if not slug:
+            return json_response(
+                {'error': 'Slug parameter is required.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return await acached_response(
+            request, 'detail', lambda: self.get_listing(slug), slug=slug, private=True
+        )
+
+    async def get_listing(self, slug):
+        try:
+            payload = await PublishedListing.objects.filter(slug=slug).values_list('payload', flat=True).afirst()
+            if payload is None:
+                return json_response(
+                    {'error': 'Published listing with this slug does not exist'},
+                    status=status.HTTP_404_NOT_FOUND
                 )
+            return json_response({'listing': PublishedListingSerializer(detail=True).to_representation(payload)})
 
-        bathrooms = request.query_params.get('bathrooms')
-        if bathrooms:
-            try:
-                listings = listings.filter(bathrooms__gte=round(float(bathrooms), 1))
-            except ValueError:
-                return Response(
-                    {'error': 'Invalid bathrooms parameter.'},
-                    status=status.HTTP_400_BAD_REQUEST
+        except Exception:
+            return json_response(
+                {'error': 'An error occurred while retrieving the listing detail.'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class AsyncListingsView(View):
+    async def get(self, request):
+        return await acached_response(request, 'feed', lambda: self.get_listings(request))
+
+    async def get_listings(self, request):
+        try:
+            fields = ListingListSerializer.parse_fields(request.GET.get('fields'))
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            paginator = KeysetPagination()
+            listings = await paginator.apaginate_queryset(
+                PublishedListing.objects.values('id', 'created_at', 'payload'),
+                request
+            )
+            if not listings and paginator.is_first_page:
+                return json_response(
+                    {'error': 'No published listings found in the database.'},
+                    status=status.HTTP_404_NOT_FOUND
                 )
 
-        location = request.query_params.get('location')
-        if location:
-            listings = listings.filter(location__icontains=location)
+            return json_response({
+                'listings': PublishedListingSerializer(fields).serialize(listings),
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link(),
+            })
 
-        category = request.query_params.get('category')
-        valid_categories = [choice[0].upper() for choice in Listing.CategoryChoices.choices]
-        if category and category.upper() in valid_categories:
-            listings = listings.filter(category=category.upper())
+        except InvalidCursor as e:
+            return json_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # -----------------------
-        # 📦 ORDER + RESPONSE
-        # -----------------------
+        except Exception:
+            return json_response(
+                {'error': 'An error occurred while retrieving listings.'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
-        listings = listings.order_by('-created_at')
 
-        if not listings.exists():
-            return Response(
+class AsyncSearchListingsView(View):
+    async def get(self, request):
+        return await acached_response(request, 'search', lambda: self.search(request))
+
+    async def search(self, request):
+        try:
+            query = search_query(request.GET)
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = KeysetPagination(ordering=query['ordering'])
+        try:
+            page = await paginator.apaginate_queryset(query['rows'], request)
+        except InvalidCursor as e:
+            return json_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not page and paginator.is_first_page:
+            return json_response(
                 {'error': 'No listings found matching the criteria.'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        serializer = ListingSerializer(listings, many=True)
-
-        return Response(
-            {
-                'count': listings.count(),
-                'results': serializer.data
-            },
-            status=status.HTTP_200_OK
-        )
+        return json_response({
+            'count': await paginator.aget_count(query['listings'], page),
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': search_results(query, page)
+        })
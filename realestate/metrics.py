@@ -0,0 +1,259 @@
+"""
+Per-view request metrics.
+
+RequestMetricsMiddleware times each request, counts and times its DB
+queries (through a connection execute_wrapper) and times response
+rendering: DRF's, and that of views rendering their own JSON inside
+``timed_render()``. The numbers go back to the client as a Server-Timing header
+and are aggregated in-process into Prometheus histograms/counters, served
+by ``metrics_view`` in the text exposition format.
+
+The registry is per process: with several gunicorn workers, Prometheus
+sees each worker's numbers on whichever worker answers the scrape, so
+use rates and quantiles rather than absolute counts.
+"""
+import bisect
+import hmac
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from .queries import observe_queries
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+# The request being measured in this context. A contextvar rather than a
+# thread-local so it follows async views and sync_to_async calls.
+_current_request = ContextVar('metrics_request', default=None)
+
+# Reentrant so a caller can hold it across several updates that belong
+# together (one request's metrics) while each update also takes it.
+_lock = threading.RLock()
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labelnames=('view', 'method')):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labelnames = labelnames
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.series = defaultdict(lambda: [0] * (len(buckets) + 2))
+
+    def observe(self, labels, value):
+        with _lock:
+            series = self.series[labels]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le=bound)} {cumulative}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]:.6f}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=('view', 'method')):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.series = defaultdict(float)
+
+    def inc(self, labels, value=1):
+        with _lock:
+            self.series[labels] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type}'
+        for labels, value in sorted(self.series.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value:g}'
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, labels, value=1):
+        self.inc(labels, -value)
+
+
+def _labels(names, labels, **extra):
+    """
+    Label values are positional for ``names``; any extra (key, value)
+    pairs after them are appended as-is.
+    """
+    pairs = [*zip(names, labels), *labels[len(names):], *extra.items()]
+    if not pairs:
+        return ''
+    body = ','.join(f'{key}="{_escape(value)}"' for key, value in pairs)
+    return '{' + body + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUESTS = Counter('http_requests_total', 'Requests by view, method and status.')
+DURATION = Histogram('http_request_duration_seconds', 'Wall time per request.', DURATION_BUCKETS)
+DB_QUERIES = Histogram('http_request_db_queries', 'DB queries per request.', QUERY_BUCKETS)
+DB_TIME = Histogram('http_request_db_seconds', 'Time spent in DB queries per request.', DURATION_BUCKETS)
+RENDER_TIME = Histogram('http_request_render_seconds', 'Time spent rendering the response body.', DURATION_BUCKETS)
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Response body size (non-streaming).', SIZE_BUCKETS)
+
+# Password hashing pool (see users/hashing.py).
+HASH_QUEUE = Gauge('password_hash_queue_depth', 'Password hashes running or waiting for a worker.', ())
+HASH_WAIT = Histogram('password_hash_wait_seconds', 'Time a password hash waited for a worker.',
+                      DURATION_BUCKETS, ('operation',))
+HASH_TIME = Histogram('password_hash_seconds', 'Time spent computing a password hash.',
+                      DURATION_BUCKETS, ('operation',))
+HASH_REJECTED = Counter('password_hash_rejected_total', 'Password hashes refused because the pool was full.',
+                        ('operation',))
+
+METRICS = (
+    REQUESTS, DURATION, DB_QUERIES, DB_TIME, RENDER_TIME, RESPONSE_SIZE,
+    HASH_QUEUE, HASH_WAIT, HASH_TIME, HASH_REJECTED,
+)
+
+
+class QueryTimer:
+    """
+    execute_wrapper that counts and times the queries it observes.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REQUEST_METRICS_ENABLED:
+            return self.get_response(request)
+
+        request._render_time = 0.0
+        token = _current_request.set(request)
+        start = time.perf_counter()
+        try:
+            with observe_queries(QueryTimer()) as timer:
+                response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self.finish(request, response, time.perf_counter() - start, timer)
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_METRICS_ENABLED:
+            return await self.get_response(request)
+
+        request._render_time = 0.0
+        token = _current_request.set(request)
+        start = time.perf_counter()
+        try:
+            with observe_queries(QueryTimer()) as timer:
+                response = await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self.finish(request, response, time.perf_counter() - start, timer)
+
+    def finish(self, request, response, duration, timer):
+        render = request._render_time
+        response['Server-Timing'] = (
+            f'app;dur={(duration - timer.duration - render) * 1000:.1f}, '
+            f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries", '
+            f'render;dur={render * 1000:.1f}, '
+            f'total;dur={duration * 1000:.1f}'
+        )
+        self.record(request, response, duration, timer, render)
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs just before DRF renders the response; the post-render
+        # callback closes the timer.
+        start = time.perf_counter()
+
+        def done(rendered):
+            request._render_time += time.perf_counter() - start
+        response.add_post_render_callback(done)
+        return response
+
+    def record(self, request, response, duration, timer, render):
+        match = request.resolver_match
+        labels = (match.view_name if match else '<unmatched>', request.method)
+        with _lock:
+            REQUESTS.inc((*labels, ('status', response.status_code)))
+            DURATION.observe(labels, duration)
+            DB_QUERIES.observe(labels, timer.count)
+            DB_TIME.observe(labels, timer.duration)
+            RENDER_TIME.observe(labels, render)
+            if not response.streaming:
+                RESPONSE_SIZE.observe(labels, len(response.content))
+
+
+@contextmanager
+def timed_render():
+    """
+    Count the block as render time of the request being measured, for
+    responses rendered outside DRF.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request = _current_request.get()
+        if request is not None:
+            request._render_time += time.perf_counter() - start
+
+
+def render_metrics():
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Needs ``Authorization: Bearer
+    <METRICS_TOKEN>`` when a token is configured, otherwise a staff session.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+    else:
+        allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed:
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
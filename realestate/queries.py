@@ -0,0 +1,225 @@
+"""
+Query inspection: N+1 detection, slow-query logging and query budgets.
+
+``inspect_queries()`` installs an execute_wrapper on every connection and
+records each query's SQL shape (literals and IN-lists collapsed) and
+duration. On exit it logs shapes that ran more than
+QUERY_INSPECTOR_REPEAT_THRESHOLD times, the usual sign of a lazy
+relation being loaded per row, and logs queries slower than
+QUERY_INSPECTOR_SLOW_MS together with their EXPLAIN plan. Given budgets,
+it raises QueryBudgetExceeded instead of only logging.
+
+QueryInspectorMiddleware applies it to every request when
+QUERY_INSPECTOR_ENABLED is on, raising only with QUERY_INSPECTOR_RAISE
+(the test suites turn both on, so an N+1 fails the test that hits it).
+
+Both this and the request metrics see queries through
+``observe_queries()``. Connections are per thread, and under ASGI a
+request's ORM calls run on sync_to_async threads rather than the one
+the middleware runs on, so instead of wrapping "the" connection every
+connection carries one permanent wrapper that forwards to whatever
+observers the current context (a contextvar, which follows the request
+onto those threads) has registered.
+"""
+import functools
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# At most this many EXPLAINs per inspected block, so one slow page
+# doesn't turn into dozens of extra queries.
+MAX_EXPLAINS = 3
+
+_in_list = re.compile(r'\bIN \((?:%s|\?)(?:, ?(?:%s|\?))*\)', re.IGNORECASE)
+_string = re.compile(r"'(?:[^']|'')*'")
+_number = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+_space = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# -----------------------
+# Query observers
+# -----------------------
+
+_observers = ContextVar('query_observers', default=())
+
+
+def _observe(execute, sql, params, many, context):
+    call = execute
+    for observer in reversed(_observers.get()):
+        call = functools.partial(observer, call)
+    return call(sql, params, many, context)
+
+
+def install_observer(connection, **kwargs):
+    if _observe not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_observe)
+
+
+connection_created.connect(install_observer)
+
+
+@contextmanager
+def observe_queries(wrapper):
+    """
+    Call ``wrapper`` (an execute_wrapper) for every query run in this
+    context, on any thread it continues on.
+    """
+    # Connections opened before this module was imported missed the
+    # signal; cover the ones on this thread.
+    for connection in connections.all():
+        install_observer(connection)
+    token = _observers.set(_observers.get() + (wrapper,))
+    try:
+        yield wrapper
+    finally:
+        _observers.reset(token)
+
+
+def sql_shape(sql):
+    """
+    ``sql`` with literals and placeholder lists collapsed, so the same
+    query with different parameters has the same shape.
+    """
+    shape = _string.sub('?', sql)
+    shape = _number.sub('?', shape)
+    shape = shape.replace('%s', '?')
+    shape = _in_list.sub('IN (...)', shape)
+    return _space.sub(' ', shape).strip()
+
+
+class QueryInspector:
+    """
+    execute_wrapper recording (alias, sql, params, duration) per query.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((context['connection'].alias, sql, params, time.perf_counter() - start))
+
+    def shapes(self):
+        return Counter(sql_shape(sql) for _, sql, _, _ in self.queries)
+
+    def repeated(self, threshold):
+        """
+        [(shape, count)] for shapes that ran more than ``threshold`` times.
+        """
+        return [(shape, count) for shape, count in self.shapes().most_common() if count > threshold]
+
+    def slow(self, threshold_ms):
+        return [query for query in self.queries if query[3] * 1000 >= threshold_ms]
+
+    def report(self, label, repeat_threshold, slow_ms):
+        for shape, count in self.repeated(repeat_threshold):
+            logger.warning('%s: query ran %s times (possible N+1): %s', label, count, shape)
+        for alias, sql, params, duration in self.slow(slow_ms)[:MAX_EXPLAINS]:
+            logger.warning(
+                '%s: slow query (%.1f ms): %s\n%s',
+                label, duration * 1000, sql, explain(alias, sql, params),
+            )
+
+    def finish(self, label, max_queries=None, max_repeats=None, repeat_threshold=None, slow_ms=None):
+        """
+        Log repeats and slow queries, then enforce the budgets.
+        """
+        self.report(
+            label,
+            settings.QUERY_INSPECTOR_REPEAT_THRESHOLD if repeat_threshold is None else repeat_threshold,
+            settings.QUERY_INSPECTOR_SLOW_MS if slow_ms is None else slow_ms,
+        )
+        self.check(label, max_queries, max_repeats)
+
+    def check(self, label, max_queries=None, max_repeats=None):
+        if max_queries is not None and len(self.queries) > max_queries:
+            raise QueryBudgetExceeded(
+                f'{label}: {len(self.queries)} queries, budget is {max_queries}.\n'
+                + '\n'.join(sql for _, sql, _, _ in self.queries)
+            )
+        if max_repeats is not None:
+            repeated = self.repeated(max_repeats)
+            if repeated:
+                shape, count = repeated[0]
+                raise QueryBudgetExceeded(
+                    f'{label}: query ran {count} times, at most {max_repeats} allowed '
+                    f'(possible N+1): {shape}'
+                )
+
+
+def explain(alias, sql, params):
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return '(no plan for non-SELECT)'
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except Exception as e:
+        return f'(EXPLAIN failed: {e})'
+
+
+@contextmanager
+def inspect_queries(label='queries', max_queries=None, max_repeats=None,
+                    repeat_threshold=None, slow_ms=None):
+    """
+    Record the queries run inside the block, log repeats and slow ones,
+    then enforce ``max_queries`` / ``max_repeats`` if given.
+    """
+    with observe_queries(QueryInspector()) as inspector:
+        yield inspector
+    inspector.finish(label, max_queries, max_repeats, repeat_threshold, slow_ms)
+
+
+class QueryInspectorMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.QUERY_INSPECTOR_ENABLED:
+            return self.get_response(request)
+
+        with inspect_queries(f'{request.method} {request.path}', **self.budgets()):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not settings.QUERY_INSPECTOR_ENABLED:
+            return await self.get_response(request)
+
+        with observe_queries(QueryInspector()) as inspector:
+            response = await self.get_response(request)
+        # EXPLAIN needs a sync DB connection.
+        await sync_to_async(inspector.finish)(f'{request.method} {request.path}', **self.budgets())
+        return response
+
+    def budgets(self):
+        if not settings.QUERY_INSPECTOR_RAISE:
+            return {}
+        return {
+            'max_queries': settings.QUERY_INSPECTOR_MAX_QUERIES,
+            'max_repeats': settings.QUERY_INSPECTOR_REPEAT_THRESHOLD,
+        }
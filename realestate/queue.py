@@ -0,0 +1,122 @@
+"""
+Plumbing shared by the database-backed work queues (users.outbox,
+listings.cleanup).
+
+A queue is a table whose rows carry ``next_attempt_at`` and ``attempts``.
+Producers insert rows inside their own transaction, so work is queued
+exactly when the change that caused it commits. Workers claim due rows
+with claim_batch(), which hides them from other workers for
+CLAIM_TIMEOUT, and reschedule failures after retry_delay().
+
+Each queue is drained either in-process by a Drainer, kicked after each
+commit, or by a QueueCommand running as a separate worker.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# A claimed row is hidden from other workers for this long; if the worker
+# dies mid-batch the row becomes due again afterwards.
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def claim_batch(queryset, batch_size, now):
+    """
+    Lock and claim up to ``batch_size`` due rows of ``queryset``, oldest
+    first. Rows locked by another worker are skipped.
+    """
+    with transaction.atomic(using=queryset.db):
+        rows = list(
+            queryset
+            .select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if rows:
+            queryset.model._default_manager.db_manager(queryset.db).filter(
+                pk__in=[row.pk for row in rows]
+            ).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return rows
+
+
+def retry_delay(attempts, base, maximum):
+    """
+    Seconds ``base`` doubled after every failed attempt, capped at
+    ``maximum``.
+    """
+    return timedelta(seconds=min(base * (2 ** (attempts - 1)), maximum))
+
+
+class Drainer:
+    """
+    Runs ``process`` on a one-thread pool until it reports an empty
+    batch. ``process`` returns the number of rows it handled.
+    """
+
+    def __init__(self, name, process):
+        self.name = name
+        self.process = process
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = False
+
+    def kick(self):
+        """
+        Ask the background thread to drain the queue. Kicks that arrive
+        while a run is already queued are coalesced.
+        """
+        with self._lock:
+            if self._pending:
+                return
+            self._pending = True
+        self._executor.submit(self._drain)
+
+    def _drain(self):
+        with self._lock:
+            self._pending = False
+        close_old_connections()
+        try:
+            while self.process():
+                pass
+        except Exception:
+            logger.exception('%s: draining the queue failed', self.name)
+        finally:
+            close_old_connections()
+
+
+class QueueCommand(BaseCommand):
+    """
+    Management command draining a queue with ``process(batch_size)``,
+    once or (with --loop) as a long-running worker.
+    """
+    noun = 'rows'
+    default_interval = 5.0
+
+    def process(self, batch_size):
+        raise NotImplementedError
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting when idle.')
+        parser.add_argument(
+            '--interval', type=float, default=self.default_interval,
+            help='Seconds to sleep when idle (with --loop).',
+        )
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while processed := self.process(options['batch_size']):
+                total += processed
+            if total:
+                self.stdout.write(f'Processed {total} {self.noun}.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -1,16 +1,21 @@
 from django.contrib import admin
 from django.urls import path,include
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView,TokenVerifyView
+from rest_framework_simplejwt.views import TokenRefreshView,TokenVerifyView
 
 from django.conf import settings
 from django.conf.urls.static import static
 
+from users.views import token_obtain_view
+
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/listings/',include('listings.urls')),
     path('api/users/',include('users.urls')),
-    path('api/token/', TokenObtainPairView.as_view()),
+    path('api/token/', token_obtain_view),
     path('api/token/refresh/', TokenRefreshView.as_view()),
     path('api/token/verify/', TokenVerifyView.as_view()),
+    path('metrics', metrics_view),
     
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
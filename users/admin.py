@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserAccount, RealtorProfile
+from .models import UserAccount, RealtorProfile, EmailOutbox
 
 @admin.register(UserAccount)
 class UserAccountAdmin(admin.ModelAdmin):
@@ -10,4 +10,10 @@ class UserAccountAdmin(admin.ModelAdmin):
 admin.site.register(RealtorProfile)
 
 
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+
+
 
@@ -0,0 +1,167 @@
+"""
+JWT authentication with a per-process user cache.
+
+simplejwt's JWTAuthentication loads the UserAccount row on every
+request. CachedJWTAuthentication keeps the row's field values in a small
+TTL/LRU cache keyed by user id and builds a fresh UserAccount from them,
+so read requests (GET/HEAD/OPTIONS) skip the query. Requests that may
+write still load the row, so a view never saves stale values back.
+
+Every entry carries the user's version from the shared 'users' cache
+(one cache read per request, no query). Saving or deleting a user bumps
+that version (post_save/post_delete), so every worker drops its copy on
+its next request for the user, not just the process that made the
+change. AUTH_USER_CACHE_TTL only bounds how long an unchanged row is
+reused.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import UserAccount
+
+
+class UserCache:
+    """
+    Thread-safe LRU of {user id: (expires, version, field values)}.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic() or entry[1] != version:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[2]
+
+    def set(self, user_id, version, values):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + settings.AUTH_USER_CACHE_TTL, version, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > settings.AUTH_USER_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _version_key(user_id):
+    return f'users:version:{user_id}'
+
+
+def get_user_version(user_id):
+    cache = caches[settings.AUTH_USER_CACHE_ALIAS]
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a version that was evicted never comes
+        # back as one a worker still has an entry for.
+        seed = time.time_ns() // 1000
+        cache.add(key, seed, timeout=None)
+        version = cache.get(key, seed)
+    return version
+
+
+def bump_user_version(user_id):
+    cache = caches[settings.AUTH_USER_CACHE_ALIAS]
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        # Not set: the next read seeds a version nobody has cached.
+        pass
+
+
+user_cache = UserCache()
+
+_field_names = [field.attname for field in UserAccount._meta.concrete_fields]
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def authenticate(self, request):
+        # DRF builds authenticators per request, so this is request-local.
+        self.use_cache = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if not getattr(self, 'use_cache', False) or api_settings.USER_ID_FIELD != 'id':
+            return super().get_user(validated_token)
+        try:
+            # simplejwt puts the id in the token as a string.
+            user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        # Read before loading the row: a change that commits in between
+        # bumps the version again, so the entry stored below is never used.
+        version = get_user_version(user_id)
+        values = user_cache.get(user_id, version)
+        if values is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, version, [getattr(user, name) for name in _field_names])
+            return user
+
+        user = UserAccount.from_db(router.db_for_read(UserAccount), _field_names, values)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+
+async def authenticate_request(request):
+    """
+    DRF's authentication for a plain async Django view, which DRF can't
+    run: (user, None), or (None, the 401 DRF would have sent).
+    """
+    authenticators = [cls() for cls in drf_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    try:
+        for authenticator in authenticators:
+            result = await sync_to_async(authenticator.authenticate)(request)
+            if result is not None:
+                return result[0], None
+        exc = NotAuthenticated()
+    except APIException as e:
+        exc = e
+
+    data = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+    response = JsonResponse(data, status=401)
+    header = authenticators[0].authenticate_header(request) if authenticators else None
+    if header:
+        response['WWW-Authenticate'] = header
+    return None, response
+
+
+@receiver(post_save, sender=UserAccount)
+@receiver(post_delete, sender=UserAccount)
+def forget_cached_user(sender, instance, **kwargs):
+    pk = str(instance.pk)
+    bump_user_version(pk)
+    # Again after commit, in case a read request cached the old row
+    # before this transaction became visible.
+    transaction.on_commit(lambda: bump_user_version(pk))
@@ -0,0 +1,44 @@
+"""
+Authentication backend for UserAccount.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+from .hashing import HashingBusy
+
+UserModel = get_user_model()
+
+
+class UserAccountBackend(ModelBackend):
+    """
+    ModelBackend whose async path stays async for unknown emails too.
+
+    ModelBackend.aauthenticate hashes the password once when the user
+    doesn't exist (so it takes as long as a wrong password), but with the
+    sync set_password, which blocks the event loop waiting on the hashing
+    pool. Here that hash is awaited instead.
+
+    The async login view answers a full hashing pool (HashingBusy) with a
+    503. Sync logins (admin, sessions) have no such handler, so there it
+    is a PermissionDenied, which authenticate() treats as a failed login.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        try:
+            return super().authenticate(request, username, password, **kwargs)
+        except HashingBusy:
+            raise PermissionDenied('Too many logins in progress, try again shortly.')
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = await UserModel._default_manager.aget_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            await UserModel().aset_password(password)
+        else:
+            if await user.acheck_password(password) and self.user_can_authenticate(user):
+                return user
@@ -0,0 +1,14 @@
+from django.contrib.auth import hashers
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """
+    Argon2id at OWASP's suggested minimum (19 MiB, 2 passes, 1 lane)
+    instead of Django's 100 MiB / 8 lanes: still memory-hard, but a few
+    milliseconds per login and light enough to run several at once on
+    the hashing pool. Same algorithm name, so hashes made with other
+    parameters are upgraded on the next successful login.
+    """
+    time_cost = 2
+    memory_cost = 19 * 1024
+    parallelism = 1
@@ -0,0 +1,106 @@
+"""
+Password hashing on a bounded worker pool.
+
+Hashing and checking a password is deliberately expensive CPU work. Run
+inline, a burst of logins occupies every request thread and listing reads
+queue behind them. Here hashes run on PASSWORD_HASHING_WORKERS threads
+(hashlib and argon2-cffi release the GIL while hashing); at most
+PASSWORD_HASHING_QUEUE more may wait for one, and beyond that callers get
+HashingBusy (503 with Retry-After) straight away instead of piling up.
+
+UserAccount.set_password/check_password (and their async versions) go
+through here, so every path that hashes a password is bounded: login,
+register, password change, account deletion and create_user. Queue
+depth, wait time, hash time and rejections are exported on /metrics.
+
+The bound is on hashing, not on request threads. Async callers give
+their thread back while they wait. Sync callers (the password change
+and account deletion views, admin logins, create_user) still block
+their own thread until the hash finishes; the pool only keeps them from
+all hashing at once.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import APIException
+
+from realestate.metrics import HASH_QUEUE, HASH_REJECTED, HASH_TIME, HASH_WAIT
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class HashingBusy(APIException):
+    status_code = 503
+    default_detail = 'Too many password checks in progress, try again shortly.'
+    default_code = 'hashing_busy'
+    # DRF's exception handler turns this into a Retry-After header.
+    wait = 1
+
+
+def get_pool():
+    """
+    (executor, slots), created on first use; slots bounds running plus
+    waiting hashes.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = settings.PASSWORD_HASHING_WORKERS
+            _pool = (
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash'),
+                threading.BoundedSemaphore(workers + settings.PASSWORD_HASHING_QUEUE),
+            )
+        return _pool
+
+
+def submit(operation, fn, *args):
+    """
+    Run ``fn(*args)`` on the pool and return its future, or raise
+    HashingBusy if the pool is full.
+    """
+    executor, slots = get_pool()
+    if not slots.acquire(blocking=False):
+        HASH_REJECTED.inc((operation,))
+        raise HashingBusy()
+    HASH_QUEUE.inc(())
+    queued = time.perf_counter()
+
+    def run():
+        start = time.perf_counter()
+        HASH_WAIT.observe((operation,), start - queued)
+        try:
+            return fn(*args)
+        finally:
+            HASH_TIME.observe((operation,), time.perf_counter() - start)
+
+    def done(future):
+        HASH_QUEUE.dec(())
+        slots.release()
+
+    future = executor.submit(run)
+    future.add_done_callback(done)
+    return future
+
+
+def make_password(password):
+    return submit('make_password', hashers.make_password, password).result()
+
+
+async def amake_password(password):
+    return await asyncio.wrap_future(submit('make_password', hashers.make_password, password))
+
+
+def verify_password(password, encoded):
+    """
+    (is_correct, must_update), see django.contrib.auth.hashers.
+    """
+    return submit('verify_password', hashers.verify_password, password, encoded).result()
+
+
+async def averify_password(password, encoded):
+    return await asyncio.wrap_future(submit('verify_password', hashers.verify_password, password, encoded))
@@ -0,0 +1,11 @@
+from realestate.queue import QueueCommand
+from users.outbox import dispatch_pending
+
+
+class Command(QueueCommand):
+    help = 'Send queued emails from the outbox.'
+    noun = 'emails'
+    default_interval = 5.0
+
+    def process(self, batch_size):
+        return dispatch_pending(batch_size)
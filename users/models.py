@@ -6,12 +6,15 @@ from django.contrib.auth.models import (
 )
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from . import hashing
 
 # -----------------------------
 # USER MANAGER
 # -----------------------------
 class UserAccountManager(BaseUserManager):
-    def create_user(self, email, name, role='user', password=None):
+    def build_user(self, email, name, role='user', password=None):
         if not email:
             raise ValueError('Users must have an email address')
         
@@ -20,17 +23,25 @@ class UserAccountManager(BaseUserManager):
 
         email = self.normalize_email(email).lower()
 
-        user = self.model(
+        return self.model(
             email=email,
             name=name,
-            role=role
+            role=role,
+            is_active=True
         )
 
+    def create_user(self, email, name, role='user', password=None):
+        user = self.build_user(email, name, role, password)
         user.set_password(password)
-        user.is_active = True
         user.save(using=self._db)
         return user
 
+    async def acreate_user(self, email, name, role='user', password=None):
+        user = self.build_user(email, name, role, password)
+        await user.aset_password(password)
+        await user.asave(using=self._db)
+        return user
+
     def create_realtor(self, email, name, password=None):
         return self.create_user(
             email=email,
@@ -83,6 +94,35 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
 
     def __str__(self):
         return self.email
+
+    # Hashing runs on the bounded pool in users/hashing.py rather than on
+    # the request thread. Same behaviour as AbstractBaseUser otherwise,
+    # including upgrading the stored hash when the preferred hasher or its
+    # cost changed.
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    async def aset_password(self, raw_password):
+        self.password = await hashing.amake_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        is_correct, must_update = hashing.verify_password(raw_password, self.password)
+        if is_correct and must_update:
+            self.set_password(raw_password)
+            # A hash upgrade isn't a password change.
+            self._password = None
+            self.save(update_fields=['password'])
+        return is_correct
+
+    async def acheck_password(self, raw_password):
+        is_correct, must_update = await hashing.averify_password(raw_password, self.password)
+        if is_correct and must_update:
+            await self.aset_password(raw_password)
+            self._password = None
+            await self.asave(update_fields=['password'])
+        return is_correct
     
 class RealtorProfile(models.Model):
     user = models.OneToOneField(
@@ -102,6 +142,44 @@ class RealtorProfile(models.Model):
         return f"{self.user.name} - Realtor"
     
 
+# -----------------------------
+# EMAIL OUTBOX
+# -----------------------------
+class EmailOutbox(models.Model):
+    """
+    Outgoing emails, written inside the request's transaction and sent
+    later by users.outbox so SMTP latency never blocks a request.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
+
 # -----------------------------
 # SIGNALS
 # -----------------------------
@@ -0,0 +1,109 @@
+"""
+Background delivery for the EmailOutbox table.
+
+enqueue_email() only inserts a row, so it commits or rolls back with the
+request's transaction. dispatch_pending() claims due rows, sends them
+over a single SMTP connection per batch, and reschedules failures with
+exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+
+Dispatch runs either in-process on a one-thread pool kicked after each
+commit (EMAIL_OUTBOX_DISPATCH_ON_COMMIT) or from the
+``process_email_outbox`` management command; see realestate/queue.py.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from realestate.queue import Drainer, claim_batch, retry_delay
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(subject, body, to, from_email=None):
+    message = EmailOutbox.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+    )
+    if settings.EMAIL_OUTBOX_DISPATCH_ON_COMMIT:
+        transaction.on_commit(kick)
+    return message
+
+
+def kick():
+    drainer.kick()
+
+
+def dispatch_pending(batch_size=None):
+    """
+    Send one batch of due messages. Returns the number of rows processed.
+    """
+    now = timezone.now()
+    messages = claim_batch(
+        EmailOutbox.objects.filter(status=EmailOutbox.PENDING),
+        batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE, now,
+    )
+    if not messages:
+        return 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for message in messages:
+            _failed(message, e)
+        return len(messages)
+
+    sent = []
+    try:
+        for message in messages:
+            try:
+                connection.send_messages([EmailMessage(
+                    message.subject,
+                    message.body,
+                    message.from_email,
+                    message.to,
+                    connection=connection,
+                )])
+            except Exception as e:
+                _failed(message, e)
+            else:
+                sent.append(message.pk)
+    finally:
+        connection.close()
+        _sent(sent)
+    return len(messages)
+
+
+def _sent(pks):
+    # One UPDATE for the batch; failures are rare and saved one by one.
+    if pks:
+        EmailOutbox.objects.filter(pk__in=pks).update(
+            status=EmailOutbox.SENT,
+            attempts=F('attempts') + 1,
+            sent_at=timezone.now(),
+            last_error='',
+        )
+
+
+def _failed(message, error):
+    message.attempts += 1
+    message.last_error = f'{type(error).__name__}: {error}'
+    if message.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        message.status = EmailOutbox.FAILED
+        logger.error('Giving up on email %s after %s attempts: %s', message.pk, message.attempts, error)
+    else:
+        message.next_attempt_at = timezone.now() + retry_delay(
+            message.attempts, settings.EMAIL_OUTBOX_RETRY_BASE, settings.EMAIL_OUTBOX_RETRY_MAX
+        )
+        logger.warning('Email %s failed (attempt %s), retrying: %s', message.pk, message.attempts, error)
+    message.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+
+
+drainer = Drainer('email-outbox', dispatch_pending)
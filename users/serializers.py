@@ -1,4 +1,5 @@
 import email
+from asgiref.sync import sync_to_async
 from rest_framework import serializers
 from .models import UserAccount
 from .utils import send_email
@@ -34,6 +35,21 @@ class UserSerializer(serializers.ModelSerializer):
             user.email
         )
         return user
+
+    async def acreate(self, validated_data):
+        """
+        create() for the async register view; the password is hashed
+        without holding up a thread.
+        """
+        validated_data.pop('confirm_password')
+
+        user = await UserAccount.objects.acreate_user(
+            email=validated_data['email'],
+            name=validated_data['name'],
+            password=validated_data['password']
+        )
+        await sync_to_async(send_email)(user.name, user.email)
+        return user
     
 
 
@@ -1,3 +1,234 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from realestate.metrics import HASH_REJECTED, HASH_TIME
+from realestate.queries import inspect_queries
+
+from .authentication import bump_user_version, user_cache
+from .models import EmailOutbox, UserAccount
+from .outbox import dispatch_pending, enqueue_email
+
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'users'},
+}
+
+
+class FlakyEmailBackend(EmailBackend):
+    """
+    locmem backend that fails for recipients at fail.example.com and
+    counts how many connections were opened.
+    """
+    opened = 0
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any(to.endswith('@fail.example.com') for to in message.to):
+                raise ConnectionError('SMTP unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    EMAIL_OUTBOX_DISPATCH_ON_COMMIT=False,
+    QUERY_INSPECTOR_ENABLED=True,
+    QUERY_INSPECTOR_RAISE=True,
+)
+class EmailOutboxTests(TestCase):
+
+    def test_register_queues_welcome_email_without_sending(self):
+        response = APIClient().post('/api/users/register/', {
+            'email': 'new@example.com',
+            'name': 'New User',
+            'password': 'password123',
+            'confirm_password': 'password123',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        message = EmailOutbox.objects.get()
+        self.assertEqual(message.to, ['new@example.com'])
+        self.assertEqual(message.status, EmailOutbox.PENDING)
+
+    def test_dispatch_sends_pending_batch(self):
+        # More messages than the repeat budget, so a per-message query fails.
+        for i in range(8):
+            enqueue_email('Hello', 'Body', [f'user{i}@example.com'])
+        with inspect_queries('dispatch', max_repeats=3):
+            self.assertEqual(dispatch_pending(), 8)
+        self.assertEqual(len(mail.outbox), 8)
+        sent = EmailOutbox.objects.filter(status=EmailOutbox.SENT, attempts=1, sent_at__isnull=False)
+        self.assertEqual(sent.count(), 8)
+        self.assertEqual(dispatch_pending(), 0)
+
+    @override_settings(EMAIL_BACKEND='users.tests.FlakyEmailBackend')
+    def test_batch_reuses_one_connection(self):
+        FlakyEmailBackend.opened = 0
+        for i in range(5):
+            enqueue_email('Hello', 'Body', [f'user{i}@example.com'])
+        dispatch_pending()
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(
+        EMAIL_BACKEND='users.tests.FlakyEmailBackend',
+        EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+        EMAIL_OUTBOX_RETRY_BASE=30,
+    )
+    def test_failures_back_off_then_give_up(self):
+        message = enqueue_email('Hello', 'Body', ['user@fail.example.com'])
+        enqueue_email('Hello', 'Body', ['user@example.com'])
+
+        with self.assertLogs('users.outbox', 'WARNING'):
+            dispatch_pending()
+        message.refresh_from_db()
+        self.assertEqual(message.status, EmailOutbox.PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('SMTP unavailable', message.last_error)
+        self.assertGreater(message.next_attempt_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(len(mail.outbox), 1)
+
+        # Not due yet.
+        self.assertEqual(dispatch_pending(), 0)
+
+        later = timezone.now() + timedelta(minutes=1)
+        with mock.patch('users.outbox.timezone.now', return_value=later), \
+                self.assertLogs('users.outbox', 'ERROR'):
+            dispatch_pending()
+        message.refresh_from_db()
+        self.assertEqual(message.status, EmailOutbox.FAILED)
+        self.assertEqual(message.attempts, 2)
+
+
+@override_settings(CACHES=TEST_CACHES, QUERY_INSPECTOR_ENABLED=True, QUERY_INSPECTOR_RAISE=True)
+class CachedJWTAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserAccount.objects.create_realtor('realtor@example.com', 'Realtor', 'password123')
+
+    def setUp(self):
+        user_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_read_requests_reuse_cached_user(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.json()['user']['email'], 'realtor@example.com')
+
+    def test_realtor_dashboard_skips_user_query(self):
+        self.client.get('/api/users/me/')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/listings/manage').status_code, 200)
+
+    def test_update_expires_cached_user(self):
+        self.client.get('/api/users/me/')
+        self.client.patch('/api/users/me/', {'name': 'Renamed'})
+        self.assertEqual(self.client.get('/api/users/me/').json()['user']['name'], 'Renamed')
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/users/me/')
+        user = UserAccount.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_change_in_another_process_expires_cached_user(self):
+        self.client.get('/api/users/me/')
+        # All another worker's save does here: move the shared version.
+        UserAccount.objects.filter(pk=self.user.pk).update(name='Renamed')
+        bump_user_version(str(self.user.pk))
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.json()['user']['name'], 'Renamed')
+
+    def test_deleted_user_is_rejected(self):
+        self.client.get('/api/users/me/')
+        self.client.delete('/api/users/me/', {'password': 'password123'})
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+@override_settings(QUERY_INSPECTOR_ENABLED=True, QUERY_INSPECTOR_RAISE=True)
+class PasswordHashingTests(TestCase):
+
+    def setUp(self):
+        self.user = UserAccount.objects.create_user('user@example.com', 'User', password='password123')
+
+    def login(self, password='password123'):
+        return APIClient().post('/api/token/', {'email': 'user@example.com', 'password': password}, format='json')
+
+    def test_new_passwords_use_preferred_hasher(self):
+        self.assertTrue(self.user.password.startswith('scrypt$'))
+
+    def test_login_returns_token_pair(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'refresh', 'access'})
+        self.assertEqual(self.login('wrong-password').status_code, 401)
+        self.assertEqual(APIClient().post('/api/token/', {'email': 'user@example.com'}).status_code, 400)
+
+    def test_login_rejects_malformed_body(self):
+        for body in ([1, 2], {'email': 'user@example.com', 'password': ['a']}, {'email': ['a'], 'password': 'x'}):
+            response = APIClient().post('/api/token/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_unknown_email_hashes_on_pool_without_blocking(self):
+        before = sum(HASH_TIME.series[('make_password',)][:-1])
+        # The sync helper waits on the pool, blocking the event loop.
+        with mock.patch('users.hashing.make_password', side_effect=AssertionError('sync hash')):
+            response = APIClient().post(
+                '/api/token/', {'email': 'nobody@example.com', 'password': 'password123'}, format='json'
+            )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(sum(HASH_TIME.series[('make_password',)][:-1]), before + 1)
+
+    def test_login_upgrades_old_hash(self):
+        UserAccount.objects.filter(pk=self.user.pk).update(
+            password=make_password('password123', hasher='pbkdf2_sha256')
+        )
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$'))
+        self.assertTrue(self.user.check_password('password123'))
+
+    def test_full_pool_rejects_with_retry_after(self):
+        rejected = HASH_REJECTED.series[('verify_password',)]
+        with mock.patch('users.hashing.get_pool', return_value=(None, threading.Semaphore(0))):
+            response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertIn('detail', response.json())
+        self.assertEqual(HASH_REJECTED.series[('verify_password',)], rejected + 1)
+
+    def test_full_pool_fails_sync_logins_without_error(self):
+        with mock.patch('users.hashing.get_pool', return_value=(None, threading.Semaphore(0))):
+            self.assertIsNone(authenticate(None, email='user@example.com', password='password123'))
+            response = self.client.post('/admin/login/', {'username': 'user@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_password_change_runs_on_pool(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        before = sum(HASH_TIME.series[('make_password',)][:-1])
+        response = client.put('/api/users/me/', {'old_password': 'password123', 'new_password': 'password456'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(HASH_TIME.series[('make_password',)][:-1]), before + 1)
+        self.assertEqual(self.login('password456').status_code, 200)
@@ -1,7 +1,7 @@
 from django.urls import path
-from .views import RegisterView, UserView
+from .views import UserView, register_view
 
 urlpatterns = [
-    path('register/', RegisterView.as_view(), name='register'),
+    path('register/', register_view, name='register'),
     path('me/', UserView.as_view(), name='me'),
 ]
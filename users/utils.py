@@ -1,16 +1,18 @@
-from django.core.mail import send_mail
 from django.conf import settings
 
+from .outbox import enqueue_email
+
 def send_email(name, email):
+    """
+    Queue the welcome email; users.outbox delivers it in the background.
+    """
     subject = 'Welcome to Real Estate Platform'
     body = f'''
              Hi {name}, Thank you for registering at our Real Estate Platform. Best regards, Real Estate Team.
             '''
-    send_mail(
+    enqueue_email(
         subject,
         body,
-        settings.EMAIL_HOST_USER,
         [email],
-        fail_silently=False,
+        from_email=settings.EMAIL_HOST_USER,
     )
-    
\ No newline at end of file
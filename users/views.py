@@ -1,27 +1,95 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.models import update_last_login
+from django.http import JsonResponse
 from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
+from .hashing import HashingBusy
 from .models import UserAccount
 from .serializers import UserSerializer, RealtorRegisterSerializer, UserUpdateSerializer
 
 
-class RegisterView(APIView):
-    permission_classes = [permissions.AllowAny]
-
-    def post(self, request):
-        serializer = UserSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+# -----------------------
+# Login / register
+# -----------------------
+# Async views: with hashing on the pool (users/hashing.py) they only await
+# it, so under ASGI a burst of logins doesn't hold a thread each. DRF's
+# APIView is sync-only, hence plain Django views answering in the same
+# shapes as the DRF views they replace.
+
+def _request_data(request):
+    return Request(request, parsers=[JSONParser(), FormParser(), MultiPartParser()]).data
+
+
+def _busy(exc):
+    return JsonResponse({'detail': str(exc.detail)}, status=exc.status_code, headers={'Retry-After': str(exc.wait)})
+
+
+@csrf_exempt
+@require_POST
+async def register_view(request):
+    try:
+        serializer = UserSerializer(data=_request_data(request))
+    except ParseError as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_400_BAD_REQUEST)
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        user = await serializer.acreate(serializer.validated_data)
+    except HashingBusy as e:
+        return _busy(e)
+
+    return JsonResponse(
+        {'success': 'User created successfully', 'user': UserSerializer(user).data},
+        status=status.HTTP_201_CREATED
+    )
+
+
+@csrf_exempt
+@require_POST
+async def token_obtain_view(request):
+    """
+    Async TokenObtainPairView: {email, password} -> {refresh, access}.
+    """
+    try:
+        data = _request_data(request)
+    except ParseError as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        # Just the serializer's field checks; its validate() authenticates
+        # synchronously.
+        credentials = TokenObtainPairSerializer().to_internal_value(data)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        user = await aauthenticate(request, **credentials)
+    except HashingBusy as e:
+        return _busy(e)
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+        return JsonResponse(
+            {'detail': 'No active account found with the given credentials'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
 
-        user = serializer.save()  # 🔥 THIS triggers create() + send_email
+    refresh = RefreshToken.for_user(user)
+    if api_settings.UPDATE_LAST_LOGIN:
+        await sync_to_async(update_last_login)(None, user)
+    return JsonResponse({'refresh': str(refresh), 'access': str(refresh.access_token)})
 
-        return Response(
-            {'success': 'User created successfully', 'user': UserSerializer(user).data},
-            status=status.HTTP_201_CREATED
-        )
 
-    
 class UserView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 